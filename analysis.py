@@ -0,0 +1,99 @@
+'''
+Quick analysis of an instance before it is solved.
+
+InstanceAnalysis looks only at the preference edges and the course sizes, with a few max-flows over
+the preference graph, so it takes milliseconds where the model can take minutes:
+    -demand: how many students listed each course as their first, second and third choice
+    -runnable: the courses enough students listed to reach their minimum, with a maximum that allows
+     it; no assignment can run the others
+    -placeable: the most students that can be placed at all, a max-flow from the students through the
+     runnable courses they listed to a sink, each course passing at most its maximum
+    -upperBound: a bound on the objective. Any assignment's objective is the sum, over the distinct
+     edge weights w, of (w - the next lower weight) times the number of students it places on an edge
+     weighing at least w. Each of those counts is at most the max-flow over just those edges.
+    -bottlenecks: the courses that hold the solution back, with the reason (see BOTTLENECK_REASONS)
+
+Matcher.solve runs it first. When no student can be placed the empty assignment is optimal and
+nothing is solved, and when the greedy start already reaches upperBound it is optimal and the solver
+isn't started.
+'''
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import breadth_first_order, maximum_flow
+
+CANNOT_RUN = "Can't run: fewer students listed it than its minimum"
+LIMITS_PLACEMENT = "Full: more places would let more students in"
+OVERSUBSCRIBED = "More first choices than places"
+# The reason shown for a course, when more than one applies the first in this order
+BOTTLENECK_REASONS = (CANNOT_RUN, LIMITS_PLACEMENT, OVERSUBSCRIBED)
+
+
+def preferenceFlow(students, courses, S, courseMaxs):
+    """
+    Max-flow over source -> student (1) -> course (1 per edge) -> sink (course maximum).
+    Returns (flow value, the course indexes on the source side of the minimum cut with a full sink arc).
+    """
+    C = len(courseMaxs)
+    source, sink = S + C, S + C + 1
+    rows = np.concatenate([np.full(S, source), students, S + np.arange(C)])
+    columns = np.concatenate([np.arange(S), S + np.asarray(courses), np.full(C, sink)])
+    capacities = np.concatenate([np.ones(S + len(students)), np.maximum(courseMaxs, 0)]).astype(np.int32)
+    graph = csr_matrix((capacities, (rows, columns)), shape=(S + C + 2, S + C + 2))
+    result = maximum_flow(graph, source, sink)
+
+    # Whatever the source still reaches in the residual graph is on its side of the minimum cut
+    residual = (graph - result.flow).tocsr()
+    residual.eliminate_zeros()
+    reached = breadth_first_order(residual, source, directed=True, return_predecessors=False)
+    cutCourses = reached[(reached >= S) & (reached < S + C)] - S
+    return int(result.flow_value), np.sort(cutCourses)
+
+
+class InstanceAnalysis:
+    """
+    Example Usage:
+        analysis = InstanceAnalysis(students, courses, weights, ranks, S, courseMins, courseMaxs)
+        analysis.placeable, analysis.upperBound
+        analysis.bottlenecks  # [(course index, reason), ...]
+    """
+
+    def __init__(self, students, courses, weights, ranks, S, courseMins, courseMaxs):
+        courseMins = np.asarray(courseMins, dtype=np.int64)
+        courseMaxs = np.asarray(courseMaxs, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.int64)
+        C = len(courseMaxs)
+        self.S = S
+
+        self.demand = np.array([np.bincount(courses[ranks == rank], minlength=C) for rank in (1, 2, 3)])
+        totalDemand = self.demand.sum(axis=0)
+        self.runnable = (totalDemand >= courseMins) & (courseMaxs >= np.maximum(courseMins, 1))
+        usable = self.runnable[courses]
+
+        # One max-flow per distinct weight, from the highest weight edges down to all of them
+        self.upperBound = 0
+        self.placeable = 0
+        cutCourses = np.zeros(0, dtype=np.int64)
+        levels = np.unique(weights[usable])
+        for level, below in zip(levels, np.concatenate([[0], levels[:-1]])):
+            edges = usable & (weights >= level)
+            flow, cut = preferenceFlow(students[edges], courses[edges], S, courseMaxs)
+            self.upperBound += int(level - below) * flow
+            if level == levels[0]:
+                self.placeable, cutCourses = flow, cut
+
+        reasons = {}
+        for c in np.flatnonzero(self.demand[0] > courseMaxs):
+            reasons[c] = OVERSUBSCRIBED
+        for c in cutCourses[self.runnable[cutCourses] & (totalDemand[cutCourses] > 0)]:
+            reasons[c] = LIMITS_PLACEMENT
+        for c in np.flatnonzero(~self.runnable & (totalDemand > 0)):
+            reasons[c] = CANNOT_RUN
+        self.bottlenecks = sorted((int(c), reason) for c, reason in reasons.items())
+
+    def canPlaceAnyone(self):
+        return self.placeable > 0
+
+    def summary(self):
+        return "%d of %d students placeable, objective at most %d, %d bottleneck courses" % (
+            self.placeable, self.S, self.upperBound, len(self.bottlenecks))
@@ -0,0 +1,85 @@
+'''
+Parse time of a student roster in each upload format.
+
+Writes a synthetic roster (the configured columns plus a few extra ones, as real exports have) as
+XLSX, CSV and Parquet, then times reading it back:
+    -read_excel: the old path, every column of the workbook through pandas
+    -xlsx / csv / parquet: ingest.readTable, only the configured columns
+
+Usage:
+    python bench_ingest.py [rows] [repeats]
+
+Times are reported per 10k rows. Parquet is skipped when no Parquet engine (pyarrow) is installed.
+'''
+
+import sys
+from io import BytesIO
+from json import load
+from time import perf_counter
+
+import numpy as np
+from pandas import read_excel
+
+from ingest import readTable
+from synthetic import makeInstance
+
+
+def makeRoster(rows, config, seed=0):
+    # The configured student columns from synthetic.py plus typical extra export columns
+    roster, courses = makeInstance(rows, 60, config["students_Columns"], config["courses_Columns"], seed=seed)
+    random = np.random.default_rng(seed)
+    roster['Student ID'] = np.arange(rows)
+    roster['Email'] = ['student%d@example.org' % s for s in range(rows)]
+    roster['Grade'] = random.integers(9, 13, rows)
+    roster['Homeroom'] = ['Room %d' % room for room in random.integers(100, 400, rows)]
+    roster['Notes'] = ['' if s % 3 else 'Needs a late bus' for s in range(rows)]
+    return roster
+
+
+def encode(roster):
+    files = {}
+    xlsxData = BytesIO()
+    roster.to_excel(xlsxData, index=False, engine='xlsxwriter')
+    files['xlsx'] = xlsxData.getvalue()
+    files['csv'] = roster.to_csv(index=False).encode('utf-8')
+    try:
+        parquetData = BytesIO()
+        roster.to_parquet(parquetData, index=False)
+        files['parquet'] = parquetData.getvalue()
+    except ImportError:
+        pass
+    return files
+
+
+def best(repeats, read):
+    times = []
+    for repeat in range(repeats):
+        start = perf_counter()
+        read()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main(rows=10000, repeats=3):
+    with open('config.json') as config_file:
+        config = load(config_file)
+    columns = list(config["students_Columns"].values())
+    files = encode(makeRoster(rows, config))
+    scale = 10000.0 / rows
+
+    readers = [('read_excel', 'xlsx', lambda data: read_excel(BytesIO(data)))]
+    for kind in ('xlsx', 'csv', 'parquet'):
+        readers.append((kind, kind, lambda data: readTable(data, 0, columns)))
+
+    print('%d rows, best of %d' % (rows, repeats))
+    print('%-12s %10s %14s' % ('reader', 'bytes', 's / 10k rows'))
+    for name, kind, read in readers:
+        if kind not in files:
+            print('%-12s %10s %14s' % (name, '-', 'skipped'))
+            continue
+        seconds = best(repeats, lambda: read(files[kind]))
+        print('%-12s %10d %14.3f' % (name, len(files[kind]), seconds * scale))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
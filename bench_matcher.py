@@ -0,0 +1,166 @@
+'''
+Scaling benchmark for the matchers.
+
+Solves synthetic instances (see synthetic.py) over a grid of student and course counts and writes one
+JSON record per run with the solve status, total and per-phase time, the peak memory of the run and
+the memory growth of each phase, model size, the branch and bound nodes explored, the objective, the
+bound the solver proved with its gap, and the LP relaxation bound. Both bounds are at least the true
+optimum, so each gap is an upper bound on how far the solution can be from optimal. The records also
+have the max-flow bound of the pre-solve analysis and how many students it found can be placed at
+all (see analysis.py).
+
+Every run is a separate process, so peak memory belongs to that run alone and a run that takes
+longer than --timeout is killed and recorded as such. Runs of the dense PuLP matchers that would
+need more than --max-dense-variables variables are recorded as skipped.
+
+Every instance is solved with each of --solvers, so backends can be compared run for run.
+
+Usage:
+    python bench_matcher.py --students 500 5000 50000 --courses 20 200 1000 \\
+        --matchers HardConstraintMatcher AggregatedHardConstraintMatcher --output bench.json
+    python bench_matcher.py --matchers MatrixHardConstraintMatcher --solvers PULP_CBC_CMD HIGHS --no-warm-start
+'''
+
+import argparse
+import sys
+from io import BytesIO
+from json import dump, load
+from multiprocessing import Pipe, Process
+from time import perf_counter
+
+import matcher
+from metrics import peakMemory
+from synthetic import makeInstance
+
+DENSE_MATCHERS = ("HardConstraintMatcher",)
+
+
+def runOne(connection, matcherName, solver, S, C, config, options):
+    # Runs in a child process and sends back the record (or the error)
+    try:
+        studentsData, coursesData = makeInstance(
+            S, C, config["students_Columns"], config["courses_Columns"], skew=options.skew,
+            minFraction=options.minFraction, bulletRate=options.bulletRate, clusters=options.clusters,
+            seed=options.seed)
+        studentsFile = BytesIO(studentsData.to_csv(index=False).encode('utf-8'))
+        coursesFile = BytesIO(coursesData.to_csv(index=False).encode('utf-8'))
+
+        start = perf_counter()
+        solved = getattr(matcher, matcherName)(
+            students_FileLocation=studentsFile, students_Columns=config["students_Columns"],
+            courses_FileLocation=coursesFile, courses_Columns=config["courses_Columns"],
+            p1_ObjectiveValue=config["p1_ObjectiveValue"], p2_ObjectiveValue=config["p2_ObjectiveValue"],
+            p3_ObjectiveValue=config["p3_ObjectiveValue"])
+        solved.solve(solver=solver, timeLimit=options.timeLimit,
+                     useFlow=not options.noFlow, gapTarget=options.gapTarget, warmStart=not options.noWarmStart,
+                     localSearchTime=options.localSearchTime, workers=options.workers,
+                     linkingCuts=options.linkingCuts, presolve=options.presolve)
+        solved.outputResults(directory=None)
+        seconds = perf_counter() - start
+
+        # The LP bound of the sparse model holds for every matcher, they all solve the same problem
+        students, courses, weights, ranks = solved.preferenceEdges()
+        lpBound = matcher.AssignmentModel(students, courses, weights, solved.S, solved.courseMins,
+                                          solved.courseMaxs).relaxationBound()
+        objective = solved.results.objective
+        connection.send({
+            "status": solved.status,
+            "seconds": seconds,
+            "peakMemory": peakMemory(children=True),
+            "objective": objective,
+            "bound": solved.results.bound,
+            "gap": solved.results.gap,
+            "lpBound": lpBound,
+            "lpGap": (lpBound - objective) / lpBound if lpBound else None,
+            "analysisBound": solved.analysis.upperBound,
+            "placeable": solved.analysis.placeable,
+            "nodes": solved.nodes,
+            "model": solved.profile.modelSize(),
+            "phases": {timing.name: {"seconds": timing.seconds, "memoryGrowth": timing.memoryGrowth}
+                       for timing in solved.profile.phases},
+        })
+    except Exception as e:
+        connection.send({"status": "Error", "error": "%s: %s" % (type(e).__name__, e)})
+    finally:
+        connection.close()
+
+
+def runGrid(options, config):
+    records = []
+    for S in options.students:
+        for C in options.courses:
+            for matcherName in options.matchers:
+                for solver in options.solvers or [config["solver"]]:
+                    record = {"matcher": matcherName, "solver": solver, "S": S, "C": C, "seed": options.seed}
+                    if matcherName in DENSE_MATCHERS and S * C > options.maxDenseVariables:
+                        record["status"] = "Skipped"
+                    else:
+                        receiver, sender = Pipe(duplex=False)
+                        process = Process(target=runOne, args=(sender, matcherName, solver, S, C, config, options))
+                        process.start()
+                        sender.close()
+                        if receiver.poll(options.timeout):
+                            record.update(receiver.recv())
+                        else:
+                            record["status"] = "Timeout"
+                            process.kill()
+                        process.join()
+                    records.append(record)
+                    print("%-34s %-12s S=%-6d C=%-5d %-9s %s" % (
+                        matcherName, solver, S, C, record["status"],
+                        "%.2fs" % record["seconds"] if "seconds" in record else ""), file=sys.stderr)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the matchers on synthetic instances.")
+    parser.add_argument("--students", type=int, nargs="+", default=[500, 5000, 50000])
+    parser.add_argument("--courses", type=int, nargs="+", default=[20, 200, 1000])
+    parser.add_argument("--matchers", nargs="+", default=["HardConstraintMatcher"])
+    parser.add_argument("--solvers", nargs="+",
+                        help="solver names to compare on the same instances, e.g. PULP_CBC_CMD HIGHS; GREEDY or "
+                             "LOCALSEARCH for the fast modes, PORTFOLIO to race CBC configurations "
+                             "(default: from config.json)")
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--min-fraction", dest="minFraction", type=float, default=0.5)
+    parser.add_argument("--bullet-rate", dest="bulletRate", type=float, default=0.05)
+    parser.add_argument("--clusters", type=int, default=1,
+                        help="split students and courses into this many independent blocks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-limit", dest="timeLimit", type=int, default=60)
+    parser.add_argument("--gap-target", dest="gapTarget", type=float, default=None,
+                        help="stop once the relative gap is below this")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--no-flow", dest="noFlow", action="store_true",
+                        help="always solve the MIP, even without course minimums")
+    parser.add_argument("--no-warm-start", dest="noWarmStart", action="store_true",
+                        help="start CBC without the greedy MIP start")
+    parser.add_argument("--local-search-time", dest="localSearchTime", type=float, default=None,
+                        help="seconds of local search after a solve stopped by the time limit")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="solve independent clusters in up to this many processes")
+    parser.add_argument("--linking-cuts", dest="linkingCuts", action="store_true",
+                        help="add x <= classWillRun rows where the LP relaxation violates them")
+    parser.add_argument("--presolve", action="store_true",
+                        help="fix provably safe assignments and drop courses that can't run before the solve")
+    parser.add_argument("--max-dense-variables", dest="maxDenseVariables", type=int, default=2000000)
+    parser.add_argument("--output", help="JSON file to write, stdout by default")
+    options = parser.parse_args()
+    # Every cluster needs three courses for the students to pick from (see synthetic.makeInstance)
+    if options.clusters < 1 or min(options.courses) // options.clusters < 3:
+        parser.error("--clusters %d leaves fewer than 3 courses per cluster with --courses %d"
+                     % (options.clusters, min(options.courses)))
+
+    with open('config.json') as config_file:
+        config = load(config_file)
+    records = runGrid(options, config)
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            dump(records, output_file, indent=2)
+    else:
+        dump(records, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+On-disk solution cache for the web app.
+
+Entries are keyed by a hash of everything that decides a solve's outcome: the bytes of both uploaded
+files, the column mapping from config.json, the objective weights and the solver settings. Re-uploading
+the same workbooks therefore finds the previous result without parsing or solving anything.
+
+Each entry is one pickle file named after its key, so the cache survives worker restarts and is shared
+by every process pointed at the same directory. Reading an entry touches its file, and eviction removes
+the least recently used files once there are more than maxEntries or they take more than maxBytes.
+'''
+
+import os
+import pickle
+from hashlib import sha256
+from json import dumps
+from tempfile import NamedTemporaryFile
+
+
+class SolutionCache:
+    """
+    Example Usage:
+        cache = SolutionCache('solution_cache', maxEntries=200, maxBytes=200 * 1024 * 1024)
+        key = SolutionCache.key(studentsData, coursesData, columnConfig, settings)
+        result = cache.get(key)
+        if result is None:
+            result = solve(...)
+            cache.put(key, result)
+    """
+
+    def __init__(self, directory, maxEntries=200, maxBytes=200 * 1024 * 1024):
+        self.directory = directory
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        # bytes are hashed as they are, anything else as canonical JSON; each part is length prefixed
+        digest = sha256()
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = dumps(part, sort_keys=True).encode('utf-8')
+            digest.update(b'%d:' % len(part))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                value = pickle.load(cache_file)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def put(self, key, value):
+        # Write to a temporary file first so readers never see half an entry
+        with NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as cache_file:
+            pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file.name, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+
+        totalBytes = sum(size for mtime, size, name in entries)
+        while entries and (len(entries) > self.maxEntries or totalBytes > self.maxBytes):
+            mtime, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            totalBytes -= size
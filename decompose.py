@@ -0,0 +1,103 @@
+'''
+Connected components of the assignment model.
+
+A student is only linked to the courses they listed, so when the preference graph splits into
+clusters (grade bands, departments, campuses) the model is really several independent problems: no
+constraint involves students or courses of two clusters. solveDecomposed finds the connected
+components of the bipartite student-course graph, solves each part in its own process and puts the
+solutions back together. An assignment is optimal exactly when every part is.
+
+Parts are groups of components rather than single components, so that a roster with many tiny
+clusters doesn't start a CBC process for each one: components are spread over at most `workers`
+groups with about the same number of edges, largest component first.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter, time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def edgeComponents(students, courses, S, C):
+    """
+    Returns (labels, count): the component of every edge, numbered from 0, and the number of
+    components that have edges. Students and courses without edges don't count.
+    """
+    graph = coo_matrix((np.ones(len(students)), (students, S + courses)), shape=(S + C, S + C))
+    numComponents, nodeLabels = connected_components(graph, directed=False)
+    used, labels = np.unique(nodeLabels[students], return_inverse=True)
+    return labels, len(used)
+
+
+def groupComponents(labels, count, numGroups):
+    # The group of every edge; each component goes to the group with the fewest edges so far
+    sizes = np.bincount(labels, minlength=count)
+    loads = np.zeros(numGroups, dtype=np.int64)
+    componentGroups = np.empty(count, dtype=np.int64)
+    for component in np.argsort(-sizes, kind='stable'):
+        group = int(np.argmin(loads))
+        componentGroups[component] = group
+        loads[group] += sizes[component]
+    return componentGroups[labels]
+
+
+def solvePart(model, solver, solverPath, deadline, gapTarget, startValues):
+    # Runs in a pool process; the time limit is whatever is left of the whole solve's
+    timeLimit = None if deadline is None else max(1, int(round(deadline - time())))
+    start = perf_counter()
+    status, values, bound = model.solveWith(solver, solverPath, timeLimit, gapTarget, startValues)
+    return status, values, bound, perf_counter() - start
+
+
+def mergedStatus(statuses):
+    # Nobody assigned is always feasible, so a part without a solution still leaves a feasible whole
+    if all(status == "Optimal" for status in statuses):
+        return "Optimal"
+    if any(status in ("Optimal", "Feasible") for status in statuses):
+        return "Feasible"
+    return statuses[0]
+
+
+def solveDecomposed(model, solver, solverPath, timeLimit=None, gapTarget=None, startValues=None, workers=None):
+    """
+    Solves an AssignmentModel (see matrixmodel.py) one group of components per process, each with
+    AssignmentModel.solveWith. Returns (status, values, bound, parts) like AssignmentModel.solveCBC,
+    plus one dict per part with its size, status, objective, bound and time. The bound is the sum of
+    the parts' bounds, None if a part reported none. A part the solver stopped on without a solution
+    keeps its startValues.
+    """
+    workers = workers or os.cpu_count() or 1
+    labels, count = edgeComponents(model.students, model.courses, model.S, model.C)
+    deadline = None if timeLimit is None else time() + timeLimit
+    if count <= 1 or workers == 1:
+        # Nothing to split, solve it here as one part
+        subModels = [(model, np.arange(model.numColumns))]
+        solutions = [solvePart(model, solver, solverPath, deadline, gapTarget, startValues)]
+    else:
+        groups = groupComponents(labels, count, min(workers, count))
+        subModels = [model.subModel(np.flatnonzero(groups == group)) for group in range(groups.max() + 1)]
+        with ProcessPoolExecutor(max_workers=len(subModels)) as pool:
+            futures = [pool.submit(solvePart, subModel, solver, solverPath, deadline, gapTarget,
+                                   None if startValues is None else startValues[columns])
+                       for subModel, columns in subModels]
+            solutions = [future.result() for future in futures]
+
+    values = np.zeros(model.numColumns)
+    parts = []
+    bound = 0.0
+    for (subModel, columns), (status, subValues, subBound, seconds) in zip(subModels, solutions):
+        if status not in ("Optimal", "Feasible") and startValues is not None:
+            # The solver gave up on this part before it had a solution, keep the part's start
+            status, subValues = "Feasible", startValues[columns]
+        values[columns] = subValues
+        if status == "Optimal" and gapTarget is None:
+            subBound = subModel.objectiveValue(subValues)
+        parts.append({"components": int(len(np.unique(labels[columns[columns < model.E]]))),
+                      "students": subModel.S, "courses": subModel.C, "edges": subModel.E,
+                      "status": status, "objective": subModel.objectiveValue(subValues),
+                      "bound": subBound, "seconds": seconds})
+        bound = None if bound is None or subBound is None else bound + subBound
+    return mergedStatus([part["status"] for part in parts]), values, bound, parts
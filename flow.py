@@ -0,0 +1,43 @@
+'''
+Exact solver for instances where no course has a minimum size.
+
+Without minimums classWillRun can always be 1, so the hard constraint model is a capacitated
+transportation problem on the preference graph:
+
+    source --(cap 1)--> student --(cap 1, cost -weight)--> course --(cap max)--> sink
+
+plus a free source -> sink arc for students that stay unassigned. Eliminating the source and sink
+arcs leaves one "at most 1" row per student and one "at most max" row per course over the
+student -> course arcs. That is a network matrix, so every basic solution of the LP is integral and
+the dual simplex finds the min-cost flow exactly, with no branching and no MIP solver.
+'''
+
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix
+
+
+def canSolveAsFlow(courseMins):
+    return all(courseMin <= 0 for courseMin in courseMins)
+
+
+def solveMinCostFlow(students, courses, weights, S, courseMaxs):
+    """
+    Takes preference edge arrays (see matrixmodel.preferenceEdges) and returns (status, assigned)
+    where assigned is a boolean array marking the edges that carry flow.
+    """
+    E = len(students)
+    C = len(courseMaxs)
+    if E == 0:
+        return "Optimal", np.zeros(0, dtype=bool)
+
+    edges = np.arange(E)
+    rows = np.concatenate([students, S + np.asarray(courses)])
+    capacities = coo_matrix((np.ones(2 * E), (rows, np.concatenate([edges, edges]))), shape=(S + C, E)).tocsr()
+    rowLimits = np.concatenate([np.ones(S), np.asarray(courseMaxs, dtype=float)])
+
+    result = linprog(-np.asarray(weights, dtype=float), A_ub=capacities, b_ub=rowLimits, bounds=(0, 1),
+                     method='highs-ds')
+    if result.status != 0:
+        return "Not Solved", np.zeros(E, dtype=bool)
+    return "Optimal", result.x > 0.5
@@ -0,0 +1,107 @@
+'''
+Greedy assignment for the hard constraint model.
+
+greedyAssignment builds a feasible assignment in a few vectorized passes over the preference edges:
+    -fill: edges are taken best first (highest weight, then earliest rank); within a pass every open
+     course takes as many of its candidates as it has room for, lowest student index first
+    -repair: courses that have students but fewer than their minimum are handled closest to their
+     minimum first. A course pulls in the students who listed it and cost the least objective to
+     move: unassigned students, then students of courses that have more than their own minimum. If
+     there aren't enough, the course is closed and its students are released. The fill then runs
+     again for everyone unassigned, and the repair repeats until no course is below its minimum.
+Closed courses stay closed, repaired courses never drop below their minimum again and fills only
+add students, so the repair ends with every course either empty or between its minimum and maximum.
+
+Matchers use it as a MIP start for CBC and as the "GREEDY" solver, which skips the MIP entirely.
+'''
+
+import numpy as np
+
+
+def greedyAssignment(students, courses, weights, ranks, S, courseMins, courseMaxs):
+    """
+    Takes preference edge arrays (see matrixmodel.preferenceEdges) and returns the course index of
+    every student, -1 for no course.
+    """
+    courseMins = np.asarray(courseMins, dtype=np.int64)
+    courseMaxs = np.asarray(courseMaxs, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.int64)
+    C = len(courseMaxs)
+
+    # Passes in order of (weight desc, rank), each pass sorted by course then student
+    passKeys = np.unique(np.column_stack([-weights, ranks]), axis=0)
+    passes = []
+    for negativeWeight, rank in passKeys:
+        edges = np.flatnonzero((weights == -negativeWeight) & (ranks == rank))
+        passes.append(edges[np.lexsort((students[edges], courses[edges]))])
+
+    # Every course's edges, and the weight of a (student, course) pair by sorted key
+    byCourse = np.argsort(courses, kind='stable')
+    courseStarts = np.searchsorted(courses[byCourse], np.arange(C + 1))
+    edgeKeys = students.astype(np.int64) * C + courses
+    keyOrder = np.argsort(edgeKeys)
+    sortedKeys = edgeKeys[keyOrder]
+
+    def currentWeights(candidates):
+        # Weight each candidate's student gets now, 0 if unassigned
+        current = assignment[candidates]
+        keys = candidates.astype(np.int64) * C + np.maximum(current, 0)
+        found = keyOrder[np.minimum(np.searchsorted(sortedKeys, keys), len(sortedKeys) - 1)]
+        return np.where(current >= 0, weights[found], 0)
+
+    assignment = np.full(S, -1, dtype=np.int64)
+    sizes = np.zeros(C, dtype=np.int64)
+    # A course whose maximum is below its minimum (or 0) can never run
+    isOpen = courseMaxs >= np.maximum(courseMins, 1)
+
+    def fill():
+        for edges in passes:
+            edges = edges[(assignment[students[edges]] < 0) & isOpen[courses[edges]]]
+            edgeCourses = courses[edges]
+            # Position of each edge among its course's candidates in this pass
+            position = np.arange(len(edges)) - np.searchsorted(edgeCourses, edgeCourses)
+            taken = position < (courseMaxs - sizes)[edgeCourses]
+            assignment[students[edges[taken]]] = edgeCourses[taken]
+            sizes[:] += np.bincount(edgeCourses[taken], minlength=C)
+
+    def pull(course, needed):
+        # Move the cheapest `needed` students who listed course into it, False if there aren't enough
+        edges = byCourse[courseStarts[course]:courseStarts[course + 1]]
+        candidates = students[edges]
+        current = assignment[candidates]
+        spare = np.where(current >= 0, sizes[np.maximum(current, 0)] - courseMins[np.maximum(current, 0)], S)
+        movable = (current != course) & (spare > 0)
+        edges, candidates, current, spare = edges[movable], candidates[movable], current[movable], spare[movable]
+        if len(edges) < needed:
+            return False
+
+        # Cheapest first, but no course gives away more than it has above its minimum
+        loss = currentWeights(candidates) - weights[edges]
+        order = np.lexsort((loss, current))
+        current, spare = current[order], spare[order]
+        position = np.arange(len(order)) - np.searchsorted(current, current)
+        order = order[position < spare]
+        if len(order) < needed:
+            return False
+        chosen = order[np.argsort(loss[order], kind='stable')[:needed]]
+
+        moved = candidates[chosen]
+        leaving = assignment[moved]
+        np.subtract.at(sizes, leaving[leaving >= 0], 1)
+        assignment[moved] = course
+        sizes[course] += needed
+        return True
+
+    fill()
+    while True:
+        belowMin = np.flatnonzero(isOpen & (sizes > 0) & (sizes < courseMins))
+        if len(belowMin) == 0:
+            break
+        # Closest to the minimum first; the released students are placed again once per round
+        for course in belowMin[np.argsort(courseMins[belowMin] - sizes[belowMin], kind='stable')]:
+            if sizes[course] < courseMins[course] and not pull(course, courseMins[course] - sizes[course]):
+                isOpen[course] = False
+                assignment[assignment == course] = -1
+                sizes[course] = 0
+        fill()
+    return assignment
@@ -0,0 +1,175 @@
+'''
+Typed loading of the student and course sheets.
+
+Every column is converted once, vectorized, into the arrays the model builders use:
+    -choices: S x 3 int32 array of course ids (P1, P2, P3), 0 where the cell is blank or not a number
+    -choiceMissing: S x 3 bool mask of those blank cells
+    -courseMins / courseMaxs: int32 arrays
+A blank cell only makes that one choice missing. Reading the columns as plain lists instead let
+pandas turn a whole choice column into floats when one cell was blank, and then no student had
+integer choices any more.
+
+Values that can never be right (a choice that isn't a course number, a negative or blank course
+size) raise a ValueError naming the spreadsheet rows, instead of failing somewhere inside the solve.
+
+readTable loads an upload as XLSX, CSV or Parquet, told apart by the first bytes of the file rather
+than its name. Only the columns named in config.json are read. XLSX is streamed row by row with
+openpyxl in read-only mode, so cells of other columns are never turned into Python objects. Old
+binary .xls workbooks are recognized and turned down with a ValueError asking for .xlsx.
+'''
+
+from io import BytesIO
+
+import numpy as np
+from openpyxl import load_workbook
+from pandas import DataFrame, read_csv, read_parquet, to_numeric
+
+MISSING = 0
+
+XLSX_MAGIC = b'PK\x03\x04'
+PARQUET_MAGIC = b'PAR1'
+XLS_MAGIC = b'\xd0\xcf\x11\xe0'
+
+
+def fileFormat(source):
+    # 'xlsx', 'parquet', 'xls' or 'csv' from the first bytes of a path or a seekable file object
+    if hasattr(source, 'read'):
+        position = source.tell()
+        head = source.read(4)
+        source.seek(position)
+    else:
+        with open(source, 'rb') as sourceFile:
+            head = sourceFile.read(4)
+    if isinstance(head, str):
+        return 'csv'
+    if head == XLSX_MAGIC:
+        return 'xlsx'
+    if head == PARQUET_MAGIC:
+        return 'parquet'
+    if head == XLS_MAGIC:
+        return 'xls'
+    return 'csv'
+
+
+def readTable(source, sheetName, columns):
+    """
+    Reads the given columns of an XLSX, CSV or Parquet file (path, bytes or file object) into a
+    DataFrame. sheetName (index or name) only applies to workbooks.
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    columns = list(dict.fromkeys(columns))
+    kind = fileFormat(source)
+    if kind == 'xlsx':
+        return readWorkbookColumns(source, sheetName, columns)
+    if kind == 'parquet':
+        return read_parquet(source, columns=columns)
+    if kind == 'xls':
+        # Reading the old binary format would need xlrd, which isn't a dependency
+        raise ValueError("Excel 97-2003 (.xls) files aren't supported, please save the sheet as .xlsx or .csv")
+    table = read_csv(source, usecols=lambda name: name in columns)
+    missing = [column for column in columns if column not in table.columns]
+    if missing:
+        raise ValueError("Missing columns: %s" % ", ".join("'%s'" % column for column in missing))
+    return table[columns]
+
+
+def readWorkbookColumns(source, sheetName, columns):
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        if isinstance(sheetName, int):
+            sheet = workbook.worksheets[sheetName]
+        else:
+            sheet = workbook[sheetName]
+        header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+        positions = {}
+        for position, name in enumerate(header):
+            if name is not None and str(name) not in positions:
+                positions[str(name)] = position
+        missing = [column for column in columns if column not in positions]
+        if missing:
+            raise ValueError("Sheet '%s' is missing columns: %s"
+                             % (sheet.title, ", ".join("'%s'" % column for column in missing)))
+
+        # Only cells up to the last needed column are read from each row. Blank rows are kept so
+        # row numbers in errors match the sheet, except at the end where formatting often leaves some
+        wanted = [positions[column] for column in columns]
+        lastColumn = max(wanted) + 1
+        data = [[] for column in columns]
+        blankRows = 0
+        for row in sheet.iter_rows(min_row=2, max_col=lastColumn, values_only=True):
+            if all(cell is None for cell in row):
+                blankRows += 1
+                continue
+            row = row + (None,) * (lastColumn - len(row))
+            for values, position in zip(data, wanted):
+                values.extend([None] * blankRows)
+                values.append(row[position])
+            blankRows = 0
+    finally:
+        workbook.close()
+    return DataFrame(dict(zip(columns, data)), columns=columns)
+
+
+def spreadsheetRows(mask, limit=10):
+    # Row numbers as shown in Excel (header is row 1) for the True entries of mask
+    rows = ["%d" % (index + 2) for index in np.flatnonzero(mask)[:limit]]
+    if np.count_nonzero(mask) > limit:
+        rows.append("...")
+    return ", ".join(rows)
+
+
+def integerColumn(values):
+    """
+    Returns (numbers, missing, invalid): numbers as an int32 array with 0 where missing, missing marks
+    blank or non-numeric cells and invalid marks numbers that aren't whole.
+    """
+    numbers = to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(numbers)
+    invalid = ~missing & (numbers != np.floor(numbers))
+    numbers = np.where(missing | invalid, MISSING, numbers).astype(np.int32)
+    return numbers, missing, invalid
+
+
+class Roster:
+    """
+    Example Usage:
+        roster = Roster(readTable('Students.xlsx', 0, students_Columns.values()), students_Columns,
+                        readTable('Courses.csv', 0, courses_Columns.values()), courses_Columns)
+        roster.choices[:, 0]  # every student's P1 course id
+    """
+
+    def __init__(self, studentsData, students_Columns, coursesData, courses_Columns):
+        self.studentFirstName = studentsData[students_Columns["First_Name"]].tolist()
+        self.studentLastName = studentsData[students_Columns["Last_Name"]].tolist()
+        self.courseNames = coursesData[courses_Columns["Name"]].tolist()
+        self.S = len(self.studentFirstName)
+        self.C = len(self.courseNames)
+
+        choices = []
+        choiceMissing = []
+        for rank in ("P1", "P2", "P3"):
+            numbers, missing, invalid = integerColumn(studentsData[students_Columns[rank]])
+            outOfRange = invalid | (~missing & ((numbers < 1) | (numbers > self.C)))
+            if outOfRange.any():
+                raise ValueError("Students column '%s' must hold course numbers from 1 to %d, rows: %s"
+                                 % (students_Columns[rank], self.C, spreadsheetRows(outOfRange)))
+            choices.append(numbers)
+            choiceMissing.append(missing)
+        self.choices = np.column_stack(choices)
+        self.choiceMissing = np.column_stack(choiceMissing)
+
+        sizes = []
+        for key in ("Min", "Max"):
+            numbers, missing, invalid = integerColumn(coursesData[courses_Columns[key]])
+            bad = missing | invalid | (numbers < 0)
+            if bad.any():
+                raise ValueError("Courses column '%s' must hold whole numbers of 0 or more, rows: %s"
+                                 % (courses_Columns[key], spreadsheetRows(bad)))
+            sizes.append(numbers)
+        self.courseMins, self.courseMaxs = sizes
+
+    def choiceLists(self):
+        # P1, P2 and P3 as lists of ints, None where a choice is missing
+        return [[choice if choice != MISSING else None for choice in self.choices[:, rank].tolist()]
+                for rank in range(3)]
@@ -0,0 +1,395 @@
+'''
+Background solve jobs for the web app.
+
+A request hands the uploaded files to JobManager.submit and gets a job id back straight away. Jobs
+wait in a bounded queue and a fixed number of runner threads each start one solve at a time in its
+own process, so at most `workers` solves run at once and a burst of uploads either queues or is
+turned away instead of tying up the web server. Each solve runs in a separate process group so that
+cancelling a job also stops the CBC process it started.
+
+With a directory, every job's state and result are kept in a JobStore there as well, so any web
+worker process pointed at the same directory can show a job's status and results, serve its files
+and cancel it, whichever worker took the upload. Each worker process runs its own `workers` solves.
+Without one, jobs live only in the memory of the process that took them, which needs a single web
+worker process.
+'''
+
+import os
+import pickle
+import re
+import signal
+import traceback
+from io import BytesIO
+from multiprocessing import Pipe, Process
+from queue import Full, Queue
+from tempfile import NamedTemporaryFile
+from threading import Lock, Thread
+from time import time
+from uuid import uuid4
+
+from ingest import Roster, readTable
+from matcher import AggregatedHardConstraintMatcher
+from scenarios import Scenario, solveScenarios
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, target, args, onDone=None):
+        self.id = uuid4().hex
+        self.target = target
+        self.args = args
+        self.onDone = onDone
+        self.state = QUEUED
+        self.submitted = time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.process = None
+
+    def status(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "submitted": self.submitted,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class StoredJob(Job):
+    """
+    A job as a JobStore has it, possibly taken by another web worker process. Its result is read from
+    the store the first time it is asked for.
+    """
+
+    def __init__(self, record, resultPath):
+        self.id = record["id"]
+        self.target = None
+        self.args = ()
+        self.onDone = None
+        self.state = record["state"]
+        self.submitted = record["submitted"]
+        self.finished = record["finished"]
+        self.error = record["error"]
+        self.process = None
+        self.pid = record["pid"]
+        self.resultPath = resultPath
+        self.storedResult = None
+
+    @property
+    def result(self):
+        if self.storedResult is None and self.state == DONE:
+            with open(self.resultPath, 'rb') as result_file:
+                self.storedResult = pickle.load(result_file)
+        return self.storedResult
+
+
+class JobStore:
+    """
+    Example Usage:
+        store = JobStore('job_store')
+        store.save(job, withResult=True)  # its state, and its result once it is done
+        store.load(job.id)                # a StoredJob, None for an unknown id
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, jobId, kind):
+        return os.path.join(self.directory, "%s.%s" % (jobId, kind))
+
+    def write(self, path, value):
+        # Write to a temporary file first so readers never see half a record
+        with NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as store_file:
+            pickle.dump(value, store_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(store_file.name, path)
+
+    def save(self, job, withResult=False):
+        # The result goes first, so a worker that reads "done" always finds it
+        if withResult:
+            self.write(self.path(job.id, 'result'), job.result)
+        pid = job.process.pid if job.process is not None else getattr(job, 'pid', None)
+        self.write(self.path(job.id, 'job'), dict(job.status(), pid=pid))
+
+    def load(self, jobId):
+        # Job ids are uuid4 hex strings, anything else can't name a job file
+        if not re.fullmatch('[0-9a-f]{32}', jobId):
+            return None
+        try:
+            with open(self.path(jobId, 'job'), 'rb') as store_file:
+                record = pickle.load(store_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return StoredJob(record, self.path(jobId, 'result'))
+
+    def forget(self, cutoff):
+        # Removes the jobs that finished before cutoff; only files not written since then can be one
+        for name in os.listdir(self.directory):
+            jobId, kind = os.path.splitext(name)
+            try:
+                if kind != '.job' or os.stat(os.path.join(self.directory, name)).st_mtime >= cutoff:
+                    continue
+            except OSError:
+                continue
+            job = self.load(jobId)
+            if job is not None and job.finished is not None and job.finished < cutoff:
+                self.remove(jobId)
+
+    def remove(self, jobId):
+        for kind in ('result', 'job'):
+            try:
+                os.remove(self.path(jobId, kind))
+            except OSError:
+                pass
+
+
+def stopProcessGroup(pid):
+    # A job process and the solvers it started, from any process on the same machine
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except (AttributeError, ProcessLookupError):
+        # No process groups on this platform, or the job hasn't made its group yet
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def runInProcess(connection, target, args):
+    # Own process group, so cancelling can kill the solver subprocesses too
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    try:
+        connection.send((DONE, target(*args)))
+    except ValueError as e:
+        # Bad input (see ingest.Roster), the message says what to fix
+        connection.send((FAILED, str(e)))
+    except Exception:
+        # The traceback stays in the server's log, the page only says the solve failed
+        traceback.print_exc()
+        connection.send((FAILED, "Solve failed"))
+    finally:
+        connection.close()
+
+
+class JobManager:
+    """
+    Example Usage:
+        jobs = JobManager(workers=2, maxPending=20, directory='job_store')
+        job = jobs.submit(solveUpload, studentsData, coursesData, config)
+        jobs.get(job.id).state  # queued -> running -> done / failed / cancelled
+        jobs.cancel(job.id)
+    """
+
+    def __init__(self, workers=2, maxPending=20, keepSeconds=3600, directory=None):
+        self.jobs = {}
+        self.pending = Queue(maxsize=maxPending)
+        self.keepSeconds = keepSeconds
+        self.store = JobStore(directory) if directory is not None else None
+        self.lock = Lock()
+        for i in range(workers):
+            Thread(target=self.runJobs, daemon=True).start()
+
+    def save(self, job, withResult=False):
+        if self.store is not None:
+            self.store.save(job, withResult)
+
+    def cancelledElsewhere(self, job):
+        # Another worker process cancelled this process's job through the store
+        stored = self.store.load(job.id) if self.store is not None else None
+        if stored is None or stored.state != CANCELLED:
+            return False
+        job.state = CANCELLED
+        job.finished = stored.finished
+        return True
+
+    def submit(self, target, *args, onDone=None):
+        # onDone(result) is called from a runner thread when the job finishes successfully
+        self.forgetOldJobs()
+        job = Job(target, args, onDone)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.save(job)
+        try:
+            self.pending.put_nowait(job)
+        except Full:
+            with self.lock:
+                del self.jobs[job.id]
+                if self.store is not None:
+                    self.store.remove(job.id)
+            raise JobQueueFull("Too many solves are waiting, try again shortly")
+        return job
+
+    def addFinished(self, result):
+        # A job whose result is already known, e.g. from the solution cache
+        self.forgetOldJobs()
+        job = Job(None, ())
+        job.state = DONE
+        job.finished = time()
+        job.result = result
+        with self.lock:
+            self.jobs[job.id] = job
+            self.save(job, withResult=True)
+        return job
+
+    def get(self, jobId):
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if job is None:
+                # Taken by another worker process
+                return self.store.load(jobId) if self.store is not None else None
+            if job.state in (QUEUED, RUNNING) and self.cancelledElsewhere(job) and job.process is not None:
+                stopProcessGroup(job.process.pid)
+            return job
+
+    def cancel(self, jobId):
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if job is None and self.store is not None:
+                # Another worker process's job, stopped by its process id
+                job = self.store.load(jobId)
+                if job is None or job.state not in (QUEUED, RUNNING):
+                    return job
+                job.state = CANCELLED
+                job.finished = time()
+                self.save(job)
+                pid = job.pid
+            else:
+                if job is None or job.state not in (QUEUED, RUNNING):
+                    return job
+                job.state = CANCELLED
+                job.finished = time()
+                self.save(job)
+                pid = job.process.pid if job.process is not None and job.process.is_alive() else None
+        if pid is not None:
+            stopProcessGroup(pid)
+        return job
+
+    def forgetOldJobs(self):
+        cutoff = time() - self.keepSeconds
+        with self.lock:
+            for jobId in [jobId for jobId, job in self.jobs.items()
+                          if job.finished is not None and job.finished < cutoff]:
+                del self.jobs[jobId]
+        if self.store is not None:
+            self.store.forget(cutoff)
+
+    def runJobs(self):
+        # A runner thread; whatever goes wrong with one job is logged and the thread moves on to the next
+        while True:
+            job = self.pending.get()
+            try:
+                self.runJob(job)
+            except Exception:
+                traceback.print_exc()
+                with self.lock:
+                    if job.state in (QUEUED, RUNNING):
+                        job.state = FAILED
+                        job.finished = time()
+                        job.error = "Solve failed"
+                    job.process = None
+                    try:
+                        self.save(job)
+                    except Exception:
+                        traceback.print_exc()
+                continue
+
+            if job.state == DONE and job.onDone is not None:
+                try:
+                    job.onDone(job.result)
+                except Exception:
+                    # The job keeps its result, only the callback's work (metrics, caching) is lost
+                    traceback.print_exc()
+
+    def runJob(self, job):
+        with self.lock:
+            if job.state != QUEUED or self.cancelledElsewhere(job):
+                return
+            receiver, sender = Pipe(duplex=False)
+            # Not a daemon, so that the job can start its own pool processes (see scenarios.py)
+            job.process = Process(target=runInProcess, args=(sender, job.target, job.args))
+            job.state = RUNNING
+            try:
+                job.process.start()
+            finally:
+                sender.close()
+            self.save(job)
+
+        try:
+            state, payload = receiver.recv()
+        except EOFError:
+            # The process died without answering, either cancelled or crashed
+            state, payload = FAILED, "Solver process exited unexpectedly"
+        finally:
+            receiver.close()
+        job.process.join()
+
+        with self.lock:
+            if job.state == RUNNING and not self.cancelledElsewhere(job):
+                job.state = state
+                job.finished = time()
+                if state == DONE:
+                    job.result = payload
+                else:
+                    job.error = payload
+                self.save(job, withResult=state == DONE)
+            job.process = None
+
+
+def solveSettings(config):
+    # Everything in config.json that changes what a solve returns, also used for the cache key
+    return {key: config[key] for key in ("students_SheetName", "students_Columns",
+                                         "courses_SheetName", "courses_Columns",
+                                         "p1_ObjectiveValue", "p2_ObjectiveValue", "p3_ObjectiveValue",
+                                         "solver", "solver_TimeLimit", "solver_GapTarget",
+                                         "solver_WarmStart", "solver_LocalSearchTime",
+                                         "solver_Workers", "solver_LinkingCuts", "solver_Presolve")}
+
+
+def solveUpload(studentsData, coursesData, config):
+    matcher = AggregatedHardConstraintMatcher(
+        students_FileLocation=BytesIO(studentsData),
+        students_SheetName=config["students_SheetName"],
+        students_Columns=config["students_Columns"],
+        courses_FileLocation=BytesIO(coursesData),
+        courses_SheetName=config["courses_SheetName"],
+        courses_Columns=config["courses_Columns"],
+        p1_ObjectiveValue=config["p1_ObjectiveValue"],
+        p2_ObjectiveValue=config["p2_ObjectiveValue"],
+        p3_ObjectiveValue=config["p3_ObjectiveValue"]
+    )
+    # this is the step that takes a long time, stopping at the time limit with the best assignment found
+    matcher.solve(solver=config["solver"], timeLimit=config["solver_TimeLimit"],
+                  gapTarget=config["solver_GapTarget"], warmStart=config["solver_WarmStart"],
+                  localSearchTime=config["solver_LocalSearchTime"], workers=config["solver_Workers"],
+                  linkingCuts=config["solver_LinkingCuts"], presolve=config["solver_Presolve"])
+    matcher.outputResults(directory=None)
+    return matcher.results
+
+
+def solveScenarioUpload(studentsData, coursesData, scenarios, config):
+    # The files are parsed once for the whole batch; scenarios are dicts (see scenarios.py)
+    roster = Roster(readTable(BytesIO(studentsData), config["students_SheetName"], config["students_Columns"].values()),
+                    config["students_Columns"],
+                    readTable(BytesIO(coursesData), config["courses_SheetName"], config["courses_Columns"].values()),
+                    config["courses_Columns"])
+    defaultValues = (config["p1_ObjectiveValue"], config["p2_ObjectiveValue"], config["p3_ObjectiveValue"])
+    scenarios = [Scenario.fromDict(dict({"name": "Scenario %d" % (i + 1)}, **scenario), defaultValues, roster.C)
+                 for i, scenario in enumerate(scenarios)]
+    # Each scenario solves in one process, the batch already runs scenarios_Workers of them at once
+    solveOptions = {"solver": config["solver"], "timeLimit": config["solver_TimeLimit"],
+                    "gapTarget": config["solver_GapTarget"], "warmStart": config["solver_WarmStart"],
+                    "localSearchTime": config["solver_LocalSearchTime"], "workers": 1,
+                    "linkingCuts": config["solver_LinkingCuts"], "presolve": config["solver_Presolve"]}
+    return solveScenarios(roster, scenarios, solveOptions, matcherClass=AggregatedHardConstraintMatcher,
+                          workers=config["scenarios_Workers"])
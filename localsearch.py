@@ -0,0 +1,259 @@
+'''
+Local search over an assignment array.
+
+LocalSearch takes a feasible assignment (course index per student, -1 for none) and improves the same
+objective as HardConstraintMatcher.makeObjective, the summed weights of the preference edges used,
+while keeping every course either empty or between its minimum and maximum. Each round tries three
+kinds of moves, all found with array operations over the preference edges:
+    -shift: a student (or an unassigned student) moves to a course they weigh higher that has room
+    -swap: two students in different courses, each of whom listed the other's course, trade places
+    -ejection chain: a student enters a full course and pushes one of its students on to a course
+     with room, when the two changes together gain more than they lose
+Improving moves that don't share a student or overdraw a course are applied together. Rounds repeat
+until a round finds nothing, or the time or round budget runs out.
+
+Matchers use it to polish a time-limited CBC solution, and with the greedy start (see greedy.py) as
+the "LOCALSEARCH" solver for instances too large for the MIP. repair() first makes an assignment from
+an edited roster or other course sizes feasible, for re-solves that start from an earlier assignment
+(see session.py and scenarios.py).
+'''
+
+from time import perf_counter
+
+import numpy as np
+
+
+def groupPositions(keys):
+    # Position of every entry within its run of equal keys (keys sorted)
+    return np.arange(len(keys)) - np.searchsorted(keys, keys)
+
+
+class LocalSearch:
+    """
+    Example Usage:
+        search = LocalSearch(students, courses, weights, S, courseMins, courseMaxs)
+        assignment = search.improve(assignment, timeLimit=5)
+        search.moves  # {'shift': ..., 'swap': ..., 'chain': ...}
+    """
+
+    def __init__(self, students, courses, weights, S, courseMins, courseMaxs):
+        self.students = np.asarray(students, dtype=np.int64)
+        self.courses = np.asarray(courses, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.int64)
+        self.S = S
+        self.C = len(courseMaxs)
+        self.courseMins = np.asarray(courseMins, dtype=np.int64)
+        self.courseMaxs = np.asarray(courseMaxs, dtype=np.int64)
+
+        # Edge lookup by student * C + course
+        self.edgeKeys = self.students * self.C + self.courses
+        self.keyOrder = np.argsort(self.edgeKeys)
+        self.sortedKeys = self.edgeKeys[self.keyOrder]
+        self.moves = {"shift": 0, "swap": 0, "chain": 0}
+
+    def weightOf(self, students, courses):
+        # Weight of each (student, course) pair, 0 for no course
+        keys = students * self.C + np.maximum(courses, 0)
+        found = self.keyOrder[np.minimum(np.searchsorted(self.sortedKeys, keys), len(self.sortedKeys) - 1)]
+        return np.where(courses >= 0, self.weights[found], 0)
+
+    def objectiveValue(self, assignment):
+        return int(self.weights[assignment[self.students] == self.courses].sum())
+
+    def repair(self, assignment):
+        """
+        Returns a feasible copy of an assignment made for other choices or course sizes: students are
+        dropped from courses they didn't list, courses over their maximum keep their highest weight
+        students, and courses under their minimum are emptied.
+        """
+        repaired = np.array(assignment, dtype=np.int64)
+        assigned = np.flatnonzero(repaired >= 0)
+        listed = np.isin(assigned * self.C + repaired[assigned], self.edgeKeys)
+        repaired[assigned[~listed]] = -1
+
+        assigned = np.flatnonzero(repaired >= 0)
+        order = assigned[np.lexsort((-self.weightOf(assigned, repaired[assigned]), repaired[assigned]))]
+        repaired[order[groupPositions(repaired[order]) >= self.courseMaxs[repaired[order]]]] = -1
+
+        sizes = np.bincount(repaired[repaired >= 0], minlength=self.C)
+        underfull = (sizes > 0) & (sizes < self.courseMins)
+        repaired[(repaired >= 0) & underfull[np.maximum(repaired, 0)]] = -1
+        return repaired
+
+    def improve(self, assignment, timeLimit=None, maxRounds=None):
+        """
+        Returns an improved copy of assignment, stopping after timeLimit seconds or maxRounds rounds
+        (whichever comes first), or when no move improves it any more.
+        """
+        start = perf_counter()
+        self.assignment = np.array(assignment, dtype=np.int64)
+        assigned = self.assignment >= 0
+        self.sizes = np.bincount(self.assignment[assigned], minlength=self.C)
+        self.studentWeights = self.weightOf(np.arange(self.S), self.assignment)
+
+        rounds = 0
+        while maxRounds is None or rounds < maxRounds:
+            rounds += 1
+            gain = self.shift()
+            gain += self.swap()
+            gain += self.chain()
+            if gain <= 0 or (timeLimit is not None and perf_counter() - start > timeLimit):
+                break
+        return self.assignment
+
+    def surplus(self, courses=slice(None)):
+        # Students each course can give away: down to its minimum, or its only student
+        sizes = self.sizes[courses]
+        return np.where(sizes == 1, 1, sizes - self.courseMins[courses])
+
+    def room(self, courses=slice(None)):
+        # Students each course can take: up to its maximum, and a closed course only if it can open with one
+        sizes = self.sizes[courses]
+        canOpen = (sizes > 0) | (self.courseMins[courses] <= 1)
+        return np.where(canOpen, self.courseMaxs[courses] - sizes, 0)
+
+    def apply(self, students, courses):
+        leaving = self.assignment[students]
+        np.subtract.at(self.sizes, leaving[leaving >= 0], 1)
+        np.add.at(self.sizes, courses, 1)
+        self.assignment[students] = courses
+        self.studentWeights[students] = self.weightOf(students, courses)
+
+    def shift(self):
+        current = self.assignment[self.students]
+        delta = self.weights - self.studentWeights[self.students]
+        surplus = self.surplus()
+        sourceOK = (current < 0) | (surplus[np.maximum(current, 0)] > 0)
+        edges = np.flatnonzero((delta > 0) & (self.room()[self.courses] > 0) & sourceOK)
+        if len(edges) == 0:
+            return 0
+
+        # Each student's best move, then as many per course as it has room for and can give away
+        edges = edges[np.lexsort((-delta[edges], self.students[edges]))]
+        edges = edges[groupPositions(self.students[edges]) == 0]
+        edges = edges[np.lexsort((-delta[edges], self.courses[edges]))]
+        edges = edges[groupPositions(self.courses[edges]) < self.room()[self.courses[edges]]]
+        sources = self.assignment[self.students[edges]]
+        order = np.lexsort((-delta[edges], sources))
+        edges, sources = edges[order], sources[order]
+        edges = edges[(sources < 0) | (groupPositions(sources) < surplus[np.maximum(sources, 0)])]
+
+        self.apply(self.students[edges], self.courses[edges])
+        self.moves["shift"] += len(edges)
+        return int(delta[edges].sum())
+
+    def swap(self):
+        current = self.assignment[self.students]
+        movers = np.flatnonzero((current >= 0) & (self.courses != current))
+        if len(movers) == 0:
+            return 0
+        fromCourse, toCourse = current[movers], self.courses[movers]
+        delta = self.weights[movers] - self.studentWeights[self.students[movers]]
+
+        # Pair the k-th best mover from a to b with the k-th best mover from b to a
+        order = np.lexsort((-delta, toCourse, fromCourse))
+        movers, fromCourse, toCourse, delta = movers[order], fromCourse[order], toCourse[order], delta[order]
+        position = groupPositions(fromCourse * self.C + toCourse)
+        pairKeys = (np.minimum(fromCourse, toCourse) * self.C + np.maximum(fromCourse, toCourse)) * (self.S + 1) \
+            + position
+        forward = fromCourse < toCourse
+        matched, forwardIndex, backwardIndex = np.intersect1d(pairKeys[forward], pairKeys[~forward],
+                                                              assume_unique=True, return_indices=True)
+        forwardIndex = np.flatnonzero(forward)[forwardIndex]
+        backwardIndex = np.flatnonzero(~forward)[backwardIndex]
+        gains = delta[forwardIndex] + delta[backwardIndex]
+        improving = gains > 0
+        if not improving.any():
+            return 0
+
+        # Best swaps first, each student in at most one
+        order = np.argsort(-gains[improving], kind='stable')
+        firstStudents = self.students[movers[forwardIndex[improving][order]]]
+        secondStudents = self.students[movers[backwardIndex[improving][order]]]
+        used = set()
+        chosen = []
+        for first, second in zip(firstStudents.tolist(), secondStudents.tolist()):
+            if first not in used and second not in used:
+                used.update((first, second))
+                chosen.append((first, second))
+        if not chosen:
+            return 0
+
+        before = self.studentWeights.sum()
+        first, second = np.array(chosen).T
+        firstCourse, secondCourse = self.assignment[first], self.assignment[second]
+        self.apply(np.concatenate([first, second]), np.concatenate([secondCourse, firstCourse]))
+        self.moves["swap"] += len(chosen)
+        return int(self.studentWeights.sum() - before)
+
+    def chain(self):
+        # For every full course, its best entering student and its best student to push on elsewhere
+        current = self.assignment[self.students]
+        delta = self.weights - self.studentWeights[self.students]
+        full = self.sizes >= self.courseMaxs
+        surplus = self.surplus()
+        room = self.room()
+
+        entering = np.flatnonzero(full[self.courses] & (current != self.courses)
+                                  & ((current < 0) | (surplus[np.maximum(current, 0)] > 0)))
+        # the student leaving the full course b is the one on edge (s, c) with s in b and c with room
+        leaving = np.flatnonzero((current >= 0) & (self.courses != current) & (room[self.courses] > 0))
+        leaving = leaving[full[current[leaving]]]
+        if len(entering) == 0 or len(leaving) == 0:
+            return 0
+
+        bestIn = np.full(self.C, np.iinfo(np.int64).min)
+        np.maximum.at(bestIn, self.courses[entering], delta[entering])
+        bestOut = np.full(self.C, np.iinfo(np.int64).min)
+        np.maximum.at(bestOut, current[leaving], delta[leaving])
+        candidates = np.flatnonzero(full & (bestIn > np.iinfo(np.int64).min) & (bestOut > np.iinfo(np.int64).min))
+        candidates = candidates[bestIn[candidates] + bestOut[candidates] > 0]
+        if len(candidates) == 0:
+            return 0
+
+        # One chain per full course, best first, checked against surplus and room as each chain changes them
+        enteringEdge = {}
+        for edge in entering[np.argsort(-delta[entering], kind='stable')].tolist():
+            enteringEdge.setdefault(int(self.courses[edge]), []).append(edge)
+        leavingEdge = {}
+        for edge in leaving[np.argsort(-delta[leaving], kind='stable')].tolist():
+            leavingEdge.setdefault(int(current[edge]), []).append(edge)
+
+        gain = 0
+        used = set()
+        for course in candidates[np.argsort(-(bestIn[candidates] + bestOut[candidates]), kind='stable')].tolist():
+            move = self.bestChain(course, enteringEdge[course], leavingEdge[course], used, surplus, room)
+            if move is None:
+                continue
+            inEdge, outEdge, moveGain = move
+            first, second = int(self.students[inEdge]), int(self.students[outEdge])
+            # Only the course the first student left and the one the second joined change size
+            changed = np.array([self.assignment[first], self.courses[outEdge]])
+            changed = changed[changed >= 0]
+            self.apply(np.array([second, first]), np.array([self.courses[outEdge], course]))
+            surplus[changed] = self.surplus(changed)
+            room[changed] = self.room(changed)
+            used.update((first, second))
+            gain += moveGain
+            self.moves["chain"] += 1
+        return gain
+
+    def bestChain(self, course, inEdges, outEdges, used, surplus, room):
+        # The first entering and leaving edges (both sorted best first) still valid with current sizes
+        for inEdge in inEdges:
+            first = self.students[inEdge]
+            source = self.assignment[first]
+            if first in used or (source >= 0 and surplus[source] <= 0):
+                continue
+            for outEdge in outEdges:
+                second = self.students[outEdge]
+                target = self.courses[outEdge]
+                if second in used or self.assignment[second] != course or target == source:
+                    continue
+                if room[target] <= 0:
+                    continue
+                moveGain = (self.weights[inEdge] - self.studentWeights[first]) + \
+                    (self.weights[outEdge] - self.studentWeights[second])
+                return (inEdge, outEdge, int(moveGain)) if moveGain > 0 else None
+            return None
+        return None
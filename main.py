@@ -1,11 +1,26 @@
-from flask import Flask, render_template, request, send_file
+from flask import Flask, render_template, request, send_file, redirect, url_for, jsonify, abort, Response
+from io import BytesIO
 import xlsxwriter
-from matcher import HardConstraintMatcher
-from json import load
-import pandas as pd
+from jobs import JobManager, JobQueueFull, DONE, solveSettings, solveScenarioUpload, solveUpload
+from cache import SolutionCache
+from metrics import SolveMetrics
+from results import RESULTS_FORMAT, ScenarioResults
+from json import load, loads
 
 app = Flask(__name__)
 
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Solves run in background processes, at most jobs_Workers at a time per web worker process; every web
+# worker process finds every job in jobs_Directory
+with open('config.json') as config_file:
+    config = load(config_file)
+    jobs = JobManager(workers=config["jobs_Workers"], maxPending=config["jobs_MaxPending"],
+                      directory=config["jobs_Directory"])
+    solutionCache = SolutionCache(config["cache_Directory"], maxEntries=config["cache_MaxEntries"],
+                                  maxBytes=config["cache_MaxBytes"])
+    metrics = SolveMetrics()
+
 
 @app.route('/')
 def upload():
@@ -15,66 +30,96 @@ def upload():
 @app.route('/success', methods=['POST'])
 def success():
     if request.method == 'POST':
-        # Solve from input
-        students_FileLocation = request.files['file1']
-        courses_FileLocation = request.files['file2']
+        # Queue a solve for the uploaded files and send the browser to the job page
         with open('config.json') as config_file:
             config = load(config_file)
-            matcher = HardConstraintMatcher(
-                students_FileLocation=students_FileLocation,
-                students_SheetName=config["students_SheetName"],
-                students_Columns=config["students_Columns"],
-                courses_FileLocation=courses_FileLocation,
-                courses_SheetName=config["courses_SheetName"],
-                courses_Columns=config["courses_Columns"]
-            )
-        matcher.solve()  # this is the step that takes a long time
-        matcher.outputResults()
-
-        # open csv file
-        a = open("Output_Stats.csv", 'r')
-        a = a.readlines()
-        output_stats = [val.replace('\n', '') for val in a]
-        statTable = {}
-        for line in output_stats:
-            x = line.split(':')
-            statTable[x[0]] = x[1]
-
-        assignedStudents_values = {}
-        assignedStudents_DF = pd.read_csv('Output_Assigned_Students.csv')
-        assignedStudents_list = assignedStudents_DF.values.tolist()
-        print(assignedStudents_list)
-        for index, row in assignedStudents_DF.iterrows():
-            assignedStudents_values[index] = assignedStudents_list[index]
-
-        courses_values = {}
-        courses_DF = pd.read_csv('Output_Courses.csv')
-        courses_list = courses_DF.values.tolist()
-        print(courses_list)
-        for index, row in courses_DF.iterrows():
-            courses_values[index] = courses_list[index]
-
-        unassignedStudents_values = {}
-        unassignedStudents_DF = pd.read_csv('Output_Unassigned_Students.csv')
-        unassignedStudents_list = unassignedStudents_DF.values.tolist()
-        print(unassignedStudents_list)
-        for index, row in unassignedStudents_DF.iterrows():
-            unassignedStudents_values[index] = unassignedStudents_list[index]
-
-        nonuniqueStudents_values = {}
-        nonuniqueStudents_DF = pd.read_csv('Output_BulletVoting_Students.csv')
-        nonuniqueStudents_list = nonuniqueStudents_DF.values.tolist()
-        print(nonuniqueStudents_list)
-        for index, row in nonuniqueStudents_DF.iterrows():
-            nonuniqueStudents_values[index] = nonuniqueStudents_list[index]
-
-        return render_template("success.html",
-                               statTable=statTable,
-                               assignedStudents_columns=assignedStudents_DF.columns, assignedStudents_values=assignedStudents_values,
-                               courses_columns=courses_DF.columns, courses_values=courses_values,
-                               unassignedStudents_columns=unassignedStudents_DF.columns, unassignedStudents_values=unassignedStudents_values,
-                               nonuniqueStudents_columns = nonuniqueStudents_DF.columns, nonuniqueStudents_values = nonuniqueStudents_values,
-                               )
+        studentsData = request.files['file1'].read()
+        coursesData = request.files['file2'].read()
+
+        # The same files and settings were solved before
+        cacheKey = SolutionCache.key(studentsData, coursesData, solveSettings(config), RESULTS_FORMAT)
+        cachedResult = solutionCache.get(cacheKey)
+        if cachedResult is not None:
+            metrics.countCacheHit()
+            job = jobs.addFinished(cachedResult)
+            return redirect(url_for('show_Job', jobId=job.id), code=303)
+
+        def onDone(result):
+            metrics.observe(result)
+            solutionCache.put(cacheKey, result)
+
+        try:
+            job = jobs.submit(solveUpload, studentsData, coursesData, config, onDone=onDone)
+        except JobQueueFull as e:
+            return str(e), 503
+        return redirect(url_for('show_Job', jobId=job.id), code=303)
+
+
+@app.route('/scenarios', methods=['POST'])
+def compare_Scenarios():
+    # Queue one job that solves every scenario of the batch (see scenarios.py) on the uploaded files
+    with open('config.json') as config_file:
+        config = load(config_file)
+    studentsData = request.files['file1'].read()
+    coursesData = request.files['file2'].read()
+    try:
+        scenarios = loads(request.form['scenarios'])
+    except ValueError as e:
+        return "Scenarios must be a JSON list: %s" % e, 400
+    if not isinstance(scenarios, list) or not scenarios or not all(isinstance(s, dict) for s in scenarios):
+        return "Scenarios must be a list of at least one scenario", 400
+    if len(scenarios) > config["scenarios_MaxScenarios"]:
+        return "At most %d scenarios can be compared at once" % config["scenarios_MaxScenarios"], 400
+
+    try:
+        job = jobs.submit(solveScenarioUpload, studentsData, coursesData, scenarios, config)
+    except JobQueueFull as e:
+        return str(e), 503
+    return redirect(url_for('show_Job', jobId=job.id), code=303)
+
+
+@app.route('/jobs/<jobId>')
+def show_Job(jobId):
+    job = jobs.get(jobId)
+    if job is None:
+        abort(404)
+    if job.state == DONE and isinstance(job.result, ScenarioResults):
+        return render_template("scenarios.html", jobId=job.id, results=job.result)
+    if job.state == DONE:
+        return render_template("success.html", jobId=job.id, results=job.result)
+    return render_template("job.html", job=job.status())
+
+
+@app.route('/jobs/<jobId>/status')
+def return_JobStatus(jobId):
+    job = jobs.get(jobId)
+    if job is None:
+        abort(404)
+    return jsonify(job.status())
+
+
+@app.route('/jobs/<jobId>/results')
+def return_JobResults(jobId):
+    job = jobs.get(jobId)
+    if job is None:
+        abort(404)
+    if job.state != DONE:
+        return jsonify(job.status()), 409
+    return jsonify(job.result.toDict())
+
+
+@app.route('/jobs/<jobId>/cancel', methods=['POST'])
+def cancel_Job(jobId):
+    job = jobs.cancel(jobId)
+    if job is None:
+        abort(404)
+    return jsonify(job.status())
+
+
+@app.route('/metrics')
+def show_Metrics():
+    # Phase timings and model sizes of the solves this process ran, in Prometheus text format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/getCourseTemplate')  # this is a job for GET, not POST
@@ -90,12 +135,15 @@ def plot_CourseTemplate():
     columnNames.append(columns["Min"])
     columnNames.append(columns["Max"])
 
-    workbook = xlsxwriter.Workbook('courses_template.xlsx')
+    workbookData = BytesIO()
+    workbook = xlsxwriter.Workbook(workbookData, {'in_memory': True})
     worksheet = workbook.add_worksheet()
     worksheet.write_row('A1', columnNames)
     workbook.close()
+    workbookData.seek(0)
 
-    return send_file('courses_template.xlsx', as_attachment=True)
+    return send_file(workbookData, mimetype=XLSX_MIMETYPE, download_name='courses_template.xlsx',
+                     as_attachment=True)
 
 
 @app.route('/getStudentTemplate')  # this is a job for GET, not POST
@@ -113,46 +161,62 @@ def plot_StudentTemplate():
     columnNames.append(columns["P2"])
     columnNames.append(columns["P3"])
 
-    workbook = xlsxwriter.Workbook('students_template.xlsx')
+    workbookData = BytesIO()
+    workbook = xlsxwriter.Workbook(workbookData, {'in_memory': True})
     worksheet = workbook.add_worksheet()
     worksheet.write_row('A1', columnNames)
     workbook.close()
+    workbookData.seek(0)
 
-    return send_file('students_template.xlsx', as_attachment=True)
+    return send_file(workbookData, mimetype=XLSX_MIMETYPE, download_name='students_template.xlsx',
+                     as_attachment=True)
 
-@app.route('/getAssignmentFile')  # this is a job for GET, not POST
-def return_OutputAssignment():
-    return send_file('Output_Assignment.xlsx', as_attachment=True)
 
-@app.route('/getAssignedStudents')  # this is a job for GET, not POST
-def return_AssignedStudents():
-    return send_file('Output_Assigned_Students.csv',
-                     mimetype='text/csv',
-                     attachment_filename='Output_Assigned_Students.csv',
+def send_JobFile(jobId, fileName, mimetype):
+    # Serve one of a finished job's Output_* files from memory
+    job = jobs.get(jobId)
+    if job is None:
+        abort(404)
+    if job.state != DONE:
+        return jsonify(job.status()), 409
+    # Scenario jobs and assignment jobs have different files
+    data = job.result.files.get(fileName)
+    if data is None:
+        abort(404)
+    return send_file(BytesIO(data),
+                     mimetype=mimetype,
+                     download_name=fileName,
                      as_attachment=True)
 
 
-@app.route('/getCourses')  # this is a job for GET, not POST
-def return_Courses():
-    return send_file('Output_Courses.csv',
-                     mimetype='text/csv',
-                     attachment_filename='Output_Courses.csv',
-                     as_attachment=True)
+@app.route('/jobs/<jobId>/getAssignmentFile')  # this is a job for GET, not POST
+def return_OutputAssignment(jobId):
+    return send_JobFile(jobId, 'Output_Assignment.xlsx', XLSX_MIMETYPE)
 
 
-@app.route('/getUnassignedStudents')  # this is a job for GET, not POST
-def return_UnassignedStudents():
-    return send_file('Output_Unassigned_Students.csv',
-                     mimetype='text/csv',
-                     attachment_filename='Output_Unassigned_Students.csv',
-                     as_attachment=True)
+@app.route('/jobs/<jobId>/getAssignedStudents')  # this is a job for GET, not POST
+def return_AssignedStudents(jobId):
+    return send_JobFile(jobId, 'Output_Assigned_Students.csv', 'text/csv')
 
-@app.route('/getBulletVotingStudents')  # this is a job for GET, not POST
-def return_BulletVotingStudents():
-    return send_file('Output_BulletVoting_Students.csv',
-                     mimetype='text/csv',
-                     attachment_filename='Output_BulletVoting_Students.csv',
-                     as_attachment=True)
+
+@app.route('/jobs/<jobId>/getCourses')  # this is a job for GET, not POST
+def return_Courses(jobId):
+    return send_JobFile(jobId, 'Output_Courses.csv', 'text/csv')
+
+
+@app.route('/jobs/<jobId>/getUnassignedStudents')  # this is a job for GET, not POST
+def return_UnassignedStudents(jobId):
+    return send_JobFile(jobId, 'Output_Unassigned_Students.csv', 'text/csv')
+
+
+@app.route('/jobs/<jobId>/getScenarios')  # this is a job for GET, not POST
+def return_Scenarios(jobId):
+    return send_JobFile(jobId, 'Output_Scenarios.csv', 'text/csv')
+
+
+@app.route('/jobs/<jobId>/getBulletVotingStudents')  # this is a job for GET, not POST
+def return_BulletVotingStudents(jobId):
+    return send_JobFile(jobId, 'Output_BulletVoting_Students.csv', 'text/csv')
 
 
 if __name__ == '__main__':
@@ -47,11 +47,35 @@ What does a matcher do?
         -add a penalty term to the objective for each penalty variable
 '''
 
-from pandas import read_excel
 from csv import writer, QUOTE_MINIMAL
+from io import BytesIO, StringIO
+import os
+from math import floor
+from tempfile import mkstemp
+from time import perf_counter
 import xlsxwriter
 from pulp import LpProblem, LpMaximize, getSolver, LpVariable, LpInteger, LpAffineExpression, LpConstraint, LpStatus, \
-    value
+    LpSolutionIntegerFeasible, value
+
+from analysis import InstanceAnalysis
+from decompose import solveDecomposed
+from flow import canSolveAsFlow, solveMinCostFlow
+from greedy import greedyAssignment
+from ingest import Roster, readTable
+from localsearch import LocalSearch
+from metrics import SolveProfile
+from matrixmodel import AssignmentModel, HIGHS, PORTFOLIO, cbcBound, cbcNodes, preferenceEdges, uniqueChoiceMask
+from presolve import Presolve
+from stability import StableNeighborhood, matchPreviousAssignment
+from results import MatchResults, ResultTable, ASSIGNED_STUDENT_COLUMNS, BOTTLENECK_COLUMNS, COURSE_COLUMNS, \
+    STUDENT_COLUMNS
+import numpy as np
+
+# solve(solver=GREEDY) returns the greedy assignment (see greedy.py) without solving a model
+GREEDY = "GREEDY"
+# solve(solver=LOCAL_SEARCH) improves the greedy assignment by local search (see localsearch.py) for timeLimit seconds
+LOCAL_SEARCH = "LOCALSEARCH"
+CBC = "PULP_CBC_CMD"
 
 
 class Matcher:
@@ -79,6 +103,11 @@ class Matcher:
         )
         matcher.solve() #this is the step that takes a long time
         matcher.outputResults()
+
+    Pass roster (see ingest.py) instead of the file arguments to use data that was already parsed.
+    outputResults() fills matcher.results (see results.py) and matcher.outputFiles (file name -> bytes),
+    and writes the files to the given directory unless it is None. matcher.profile (see metrics.py)
+    has the time and memory growth of each phase. solve() describes its options.
     """
 
     def __init__(self,
@@ -101,30 +130,38 @@ class Matcher:
                  },
                  p1_ObjectiveValue=5,
                  p2_ObjectiveValue=3,
-                 p3_ObjectiveValue=1
+                 p3_ObjectiveValue=1,
+                 roster=None
                  ):
         self.c1Value = p1_ObjectiveValue
         self.c2Value = p2_ObjectiveValue
         self.c3Value = p3_ObjectiveValue
-
-        # Open Excel File
-        studentsData = read_excel(students_FileLocation,
-                                  sheet_name=students_SheetName)
-        coursesData = read_excel(courses_FileLocation,
-                                 sheet_name=courses_SheetName)
-
-        # Read Column data
-        self.studentFirstName = studentsData[students_Columns["First_Name"]].tolist()
-        self.studentLastName = studentsData[students_Columns["Last_Name"]].tolist()
-        self.courseNames = coursesData[courses_Columns["Name"]].tolist()
-        self.S = len(self.studentFirstName)
-        self.C = len(self.courseNames)
-
-        self.studentFirstChoices = studentsData[students_Columns["P1"]].tolist()
-        self.studentSecondChoices = studentsData[students_Columns["P2"]].tolist()
-        self.studentThirdChoices = studentsData[students_Columns["P3"]].tolist()
-        self.courseMins = coursesData[courses_Columns["Min"]].tolist()
-        self.courseMaxs = coursesData[courses_Columns["Max"]].tolist()
+        # Wall time and memory growth of each phase, and the model size (see metrics.py)
+        self.profile = SolveProfile()
+
+        with self.profile.phase('parse'):
+            if roster is None:
+                # Open the files (XLSX, CSV or Parquet), reading only the configured columns
+                studentsData = readTable(students_FileLocation, students_SheetName, students_Columns.values())
+                coursesData = readTable(courses_FileLocation, courses_SheetName, courses_Columns.values())
+
+                # Read Column data
+                roster = Roster(studentsData, students_Columns, coursesData, courses_Columns)
+            self.setRoster(roster)
+
+    def setRoster(self, roster):
+        # Typed column data (see ingest.py); the choice lists hold ints, or None for a missing choice
+        self.studentFirstName = roster.studentFirstName
+        self.studentLastName = roster.studentLastName
+        self.courseNames = roster.courseNames
+        self.S = roster.S
+        self.C = roster.C
+
+        self.choices = roster.choices
+        self.choiceMissing = roster.choiceMissing
+        self.studentFirstChoices, self.studentSecondChoices, self.studentThirdChoices = roster.choiceLists()
+        self.courseMins = roster.courseMins
+        self.courseMaxs = roster.courseMaxs
 
     @staticmethod
     def notUniqueChoices(c1, c2, c3):
@@ -174,114 +211,462 @@ class Matcher:
 
     def initProblem(self):
         self.model = LpProblem("TAS Matching", LpMaximize)
-        self.initVariables()
-        self.makeObjective()
-        self.makeConstraints()
+        with self.profile.phase('initVariables'):
+            self.initVariables()
+        with self.profile.phase('makeObjective'):
+            self.makeObjective()
+        with self.profile.phase('makeConstraints'):
+            self.makeConstraints()
+        self.profile.setModelSize(self.model.numVariables(), self.model.numConstraints(),
+                                  sum(len(constraint) for constraint in self.model.constraints.values()))
+
+    def preferenceEdges(self):
+        return preferenceEdges(self.choices, self.C, self.c1Value, self.c2Value, self.c3Value)
+
+    def linkingPairs(self):
+        # (students, courses) whose linking rows the LP relaxation needs (see AssignmentModel.addLinkingCuts)
+        students, courses, weights, ranks = self.preferenceEdges()
+        model = AssignmentModel(students, courses, weights, self.S, self.courseMins, self.courseMaxs)
+        self.printLinkingCuts(model.addLinkingCuts())
+        return students[model.linkedEdges], courses[model.linkedEdges]
 
-    def solve(self, solver="PULP_CBC_CMD", timeLimit=15):
+    @staticmethod
+    def printLinkingCuts(rounds):
+        for added, bound in rounds:
+            print("Linking cuts: %d rows added, LP bound was %g" % (added, bound))
+
+    def solve(self, solver="PULP_CBC_CMD", timeLimit=15, useFlow=True, gapTarget=None, warmStart=True,
+              localSearchTime=None, workers=1, linkingCuts=False, presolve=False, previousAssignment=None,
+              startAssignment=None):
+        """
+        Assigns every student it can, within timeLimit seconds. Every solve starts with a quick analysis
+        (see analysis.py); if nobody can be placed, or the greedy start (see greedy.py) already reaches
+        its upper bound, that assignment is optimal and no model is solved. Otherwise the options are:
+            -solver: the PuLP solver name, or GREEDY to keep the greedy assignment, LOCALSEARCH to improve
+             it by local search for timeLimit seconds (see localsearch.py), PORTFOLIO for multithreaded
+             CBC (the matrix matchers race CBC configurations, see portfolio.py) or HIGHS for
+             scipy.optimize.milp on the sparse arrays (the greedy start is kept if it is better)
+            -timeLimit: when the solver stops here without proving optimality, the best assignment it
+             found is kept with status "Feasible", and matcher.results has its objective, bound and gap
+            -useFlow: with no course minimums the instance is solved exactly as a min-cost flow (see
+             flow.py); False always solves the model
+            -gapTarget: stop once the relative gap is below this (e.g. 0.01)
+            -warmStart: give CBC the greedy assignment as a MIP start
+            -localSearchTime: seconds of local search on a solution the time limit stopped
+            -workers: independent clusters of the instance solved in up to this many processes
+            -linkingCuts: add x <= classWillRun rows where the LP relaxation violates them (see
+             AssignmentModel.addLinkingCuts); matcher.nodes has the branch and bound nodes explored
+            -presolve: fix the students whose best course is provably safe and drop the courses that
+             can never reach their minimum before the model is built (see presolve.py)
+            -previousAssignment: a course index per student (see readPreviousAssignment); students the
+             roster change didn't touch keep their course and only the rest are re-optimized (see
+             stability.py), so the status is "Feasible" unless everyone had to be freed
+            -startAssignment: a course index per student to start from instead of the greedy assignment,
+             repaired to fit first (see LocalSearch.repair)
+        After a PuLP solve, SolveSession (see session.py) re-solves small roster edits in place.
+        """
+        # The best bound the solver proved, None when it doesn't say (see outputResults)
+        self.bound = None
+        # Safe fixings the model is built without (see presolve.py), None for the whole instance
+        self.presolved = None
+        self.nodes = None
+        self.solver = solver
+        self.gapTarget = gapTarget
+        self.workers = workers
+        self.linkingCuts = linkingCuts
+        self.start = None
+        # An assignment to start from instead of the greedy one, repaired to fit (see greedyStart)
+        self.startAssignment = startAssignment
+        self.analyze()
+        if not self.analysis.canPlaceAnyone():
+            # No course can run, so the empty assignment is the only one
+            self.status = "Optimal"
+            self.setAssignments([], [])
+        elif solver == GREEDY:
+            self.solveGreedy()
+        elif solver == LOCAL_SEARCH:
+            self.solveGreedy()
+            self.improveAssignment(timeLimit)
+        elif previousAssignment is not None:
+            self.solveStable(previousAssignment, solver, timeLimit, gapTarget, warmStart)
+        elif useFlow and canSolveAsFlow(self.courseMins):
+            self.solveFlow()
+        else:
+            if presolve:
+                self.presolve()
+            if warmStart and self.startReachesBound():
+                self.solveGreedy()
+                self.status = "Optimal"
+                return
+            self.solveModel(solver, timeLimit, gapTarget, warmStart)
+            # The solver stopped on its time limit, polish what it found
+            if localSearchTime and self.status == "Feasible":
+                self.improveAssignment(localSearchTime)
+
+    def readPreviousAssignment(self, fileLocation, sheetName=0):
+        # Course index per student from an earlier Output_Assigned_Students file, -1 for students it doesn't list
+        previousData = readTable(fileLocation, sheetName, ['First Name', 'Last Name', 'Course Assignment'])
+        return matchPreviousAssignment(previousData, self.studentFirstName, self.studentLastName, self.C)
+
+    def solveStable(self, previousAssignment, solver, timeLimit, gapTarget=None, warmStart=True):
+        # Re-optimizes the students the change touched, widening the neighborhood while that finds nothing
+        students, courses, weights, ranks = self.preferenceEdges()
+        deadline = perf_counter() + timeLimit
+        rings = 0
+        while True:
+            with self.profile.phase('neighborhood'):
+                neighborhood = StableNeighborhood(students, courses, weights, self.S, self.courseMins,
+                                                  self.courseMaxs, previousAssignment, rings)
+            if self.presolved is not None and np.array_equal(neighborhood.fixed, self.presolved.fixed):
+                # The ring freed nobody, so no ring will: the rest of the roster isn't connected to the change
+                break
+            self.presolved = neighborhood
+            print("Stable neighborhood:", self.presolved.summary())
+            self.start = None
+            self.solveModel(solver, deadline - perf_counter(), gapTarget, warmStart)
+            if self.hasSolution() or self.presolved.freesEveryone() or perf_counter() >= deadline:
+                break
+            rings += 1
+        if not self.hasSolution() and not self.presolved.freesEveryone() and perf_counter() < deadline:
+            # No neighborhood worked, solve the whole instance once with what is left of the time
+            print("Stable neighborhood: solving every student")
+            self.presolved = None
+            self.start = None
+            self.solveModel(solver, deadline - perf_counter(), gapTarget, warmStart)
+        if self.presolved is not None and not self.presolved.freesEveryone():
+            # Optimal for the neighborhood, not for the whole instance, so the model's bound doesn't hold
+            self.status = "Feasible" if self.hasSolution() else self.status
+            self.bound = None
+
+    def analyze(self):
+        with self.profile.phase('analysis'):
+            students, courses, weights, ranks = self.preferenceEdges()
+            self.analysis = InstanceAnalysis(students, courses, weights, ranks, self.S, self.courseMins,
+                                             self.courseMaxs)
+        print("Analysis:", self.analysis.summary())
+
+    def startReachesBound(self):
+        # The greedy start is already optimal when it reaches the analysis bound
+        start = self.greedyStart()
+        students, courses, weights, ranks = self.preferenceEdges()
+        return int(weights[start[students] == courses].sum()) >= self.analysis.upperBound
+
+    def presolve(self):
+        with self.profile.phase('presolve'):
+            students, courses, weights, ranks = self.preferenceEdges()
+            self.presolved = Presolve(students, courses, weights, ranks, self.S, self.courseMins, self.courseMaxs)
+        print("Presolve:", self.presolved.summary())
+
+    def modelEdges(self):
+        # The preference edges and course minimums and maximums left to the model after presolve
+        students, courses, weights, ranks = self.preferenceEdges()
+        if self.presolved is None:
+            return students, courses, weights, ranks, self.courseMins, self.courseMaxs
+        kept = self.presolved.keptEdges
+        return students[kept], courses[kept], weights[kept], ranks[kept], \
+            self.presolved.courseMins, self.presolved.courseMaxs
+
+    def withFixed(self, students, courses):
+        # The model's (students, courses) and the assignments presolve fixed, if the model was solved
+        if self.presolved is None or not self.hasSolution():
+            return students, courses
+        fixedStudents, fixedCourses = self.presolved.fixedPairs()
+        return np.concatenate([np.asarray(students, dtype=np.int64), fixedStudents]), \
+            np.concatenate([np.asarray(courses, dtype=np.int64), fixedCourses])
+
+    def fixedWeight(self):
+        # Objective of the fixed assignments, which a model built without them leaves out of its bound
+        return 0 if self.presolved is None else self.presolved.fixedWeight
+
+    def greedyStart(self):
+        # Course index per student from the greedy heuristic, -1 for no course; built once per solve
+        if self.start is not None:
+            return self.start
+        with self.profile.phase('greedy'):
+            students, courses, weights, ranks, courseMins, courseMaxs = self.modelEdges()
+            if self.startAssignment is None:
+                start = greedyAssignment(students, courses, weights, ranks, self.S, courseMins, courseMaxs)
+            else:
+                # The given assignment, made feasible for the model's edges and sizes and improved
+                search = LocalSearch(students, courses, weights, self.S, courseMins, courseMaxs)
+                start = search.improve(search.repair(self.startAssignment))
+            if self.presolved is not None:
+                start = np.where(self.presolved.fixed >= 0, self.presolved.fixed, start)
+        print("Greedy objective value: ", weights[start[students] == courses].sum() + self.fixedWeight())
+        self.start = start
+        return start
+
+    def solveGreedy(self):
+        start = self.greedyStart()
+        self.status = "Feasible"
+        assigned = np.flatnonzero(start >= 0)
+        self.setAssignments(assigned, start[assigned])
+
+    def improveAssignment(self, timeLimit, maxRounds=None):
+        # Local search from the current assignment, which stays feasible (see localsearch.py)
+        with self.profile.phase('localSearch'):
+            students, courses, weights, ranks = self.preferenceEdges()
+            search = LocalSearch(students, courses, weights, self.S, self.courseMins, self.courseMaxs)
+            improved = search.improve(self.assignment, timeLimit, maxRounds)
+        print("Local search objective value: ", search.objectiveValue(improved), search.moves)
+        assigned = np.flatnonzero(improved >= 0)
+        self.setAssignments(assigned, improved[assigned])
+
+    def setStart(self, start):
+        # MIP start values: the start's assignments are 1, every other variable is left at 0
+        for s in np.flatnonzero(start >= 0):
+            self.studentAssignments[s][int(start[s])].setInitialValue(1)
+
+    def fixPresolved(self):
+        # The PuLP model has a variable for every pair, so the fixings become bounds: the fixed assignments
+        # are 1 and every other edge the model would leave out is 0
+        students, courses, weights, ranks = self.preferenceEdges()
+        leftOut = ~self.presolved.keptEdges & (courses != self.presolved.fixed[students])
+        for s, c in zip(students[leftOut].tolist(), courses[leftOut].tolist()):
+            self.studentAssignments[s][c].upBound = 0
+        fixedStudents, fixedCourses = self.presolved.fixedPairs()
+        for s, c in zip(fixedStudents.tolist(), fixedCourses.tolist()):
+            self.studentAssignments[s][c].lowBound = 1
+
+    def solveModel(self, solver, timeLimit, gapTarget=None, warmStart=True):
+        if solver == HIGHS:
+            # HiGHS takes the model as arrays, so the PuLP model isn't built at all
+            return self.solveHiGHS(timeLimit, gapTarget, warmStart)
         self.initProblem()
+        if self.presolved is not None:
+            self.fixPresolved()
+        if warmStart:
+            self.setStart(self.greedyStart())
+        self.solveProblem(solver, timeLimit, gapTarget, warmStart)
+
+    def solveProblem(self, solver, timeLimit, gapTarget=None, warmStart=True):
+        # Solves the PuLP model as it stands, with the start values already set, and extracts the assignment
         # self.model.writeLP("TAS.lp")
-        self.model.solve(getSolver(solver, timeLimit=timeLimit))
+        # CBC's log goes to a file so the bound can be read from it
+        logFile, logPath = mkstemp(suffix='.log')
+        os.close(logFile)
+        try:
+            with self.profile.phase('solver'):
+                # The PuLP model can't be raced, so the portfolio gets CBC's own parallel search instead
+                options = {"threads": os.cpu_count()} if solver == PORTFOLIO else {}
+                self.model.solve(getSolver(CBC if solver == PORTFOLIO else solver, msg=False, timeLimit=timeLimit,
+                                           gapRel=gapTarget, logPath=logPath, warmStart=warmStart, **options))
+            with open(logPath) as log_file:
+                log = log_file.read()
+        finally:
+            os.remove(logPath)
+        self.nodes = cbcNodes(log)
         self.status = LpStatus[self.model.status]
+        # PuLP calls a solution CBC kept when it hit the time limit optimal
+        if self.status == "Optimal" and self.model.sol_status == LpSolutionIntegerFeasible:
+            self.status = "Feasible"
+        self.bound = cbcBound(log)
         print("Status:", self.status)
         print("Objective value: ", value(self.model.objective))
-
-    def outputResults(self):
+        with self.profile.phase('extractAssignments'):
+            self.extractAssignments()
+
+    def solveHiGHS(self, timeLimit, gapTarget=None, warmStart=True):
+        with self.profile.phase('buildModel'):
+            students, courses, weights, ranks, courseMins, courseMaxs = self.modelEdges()
+            model = AssignmentModel(students, courses, weights, self.S, courseMins, courseMaxs)
+            if self.linkingCuts:
+                self.printLinkingCuts(model.addLinkingCuts())
+        self.profile.setModelSize(model.numColumns, model.numRows, model.matrix.nnz)
+        startValues = None
+        if warmStart:
+            start = self.greedyStart()
+            # Column values of the model: the start's edges, and the courses it runs
+            startValues = np.concatenate([start[students] == courses,
+                                          np.bincount(start[start >= 0], minlength=self.C) > 0]).astype(float)
+        with self.profile.phase('solver'):
+            self.status, solution, self.bound = model.solveHiGHS(timeLimit, gapTarget, startValues)
+        self.nodes = model.nodes
+        if self.bound is not None:
+            self.bound += self.fixedWeight()
+        print("Status:", self.status)
+        print("Objective value: ", model.objectiveValue(solution) + self.fixedWeight())
+        with self.profile.phase('extractAssignments'):
+            self.setAssignments(*self.withFixed(*model.assignedPairs(solution)))
+
+    def solveFlow(self):
+        with self.profile.phase('buildModel'):
+            students, courses, weights, ranks = self.preferenceEdges()
+        # One variable per edge, one row per student and per course
+        self.profile.setModelSize(len(students), self.S + self.C, 2 * len(students))
+        with self.profile.phase('solver'):
+            self.status, assigned = solveMinCostFlow(students, courses, weights, self.S, self.courseMaxs)
+        print("Status:", self.status)
+        print("Objective value: ", weights[assigned].sum())
+        with self.profile.phase('extractAssignments'):
+            self.setAssignments(students[assigned], courses[assigned])
+        self.bound = self.objectiveValue()
+
+    def setAssignments(self, students, courses):
+        # The solution as one course index per student, -1 for no course
+        students = np.asarray(students, dtype=np.int64)
+        self.assignment = np.full(self.S, -1, dtype=np.int64)
+        self.assignment[students] = courses
+        self.numMultiAssignment = int(np.count_nonzero(np.bincount(students, minlength=self.S) > 1))
+
+    def objectiveValue(self):
+        # Objective of the current assignment: the weights of the edges it uses
+        students, courses, weights, ranks = self.preferenceEdges()
+        return int(weights[self.assignment[students] == courses].sum())
+
+    def hasSolution(self):
+        # Optimal, or the incumbent of a solve stopped by the time limit; otherwise nobody is assigned
+        return self.status in ("Optimal", "Feasible")
+
+    def objectiveBound(self, objective):
+        """
+        An upper bound on the objective: the objective itself when it was proven optimal, otherwise the
+        solver's bound, or the LP relaxation of the model when the solver didn't report one, whichever
+        of that and the analysis bound is lower. Objectives are integers, so it is rounded down.
+        """
+        bound = self.bound
+        if self.status == "Optimal" and self.gapTarget is None:
+            bound = objective
+        # The fast modes don't spend time on a bound beyond the analysis
+        if bound is None and self.solver not in (GREEDY, LOCAL_SEARCH):
+            students, courses, weights, ranks = self.preferenceEdges()
+            bound = AssignmentModel(students, courses, weights, self.S, self.courseMins,
+                                    self.courseMaxs).relaxationBound()
+        if bound is None or bound > self.analysis.upperBound:
+            bound = self.analysis.upperBound
+        return max(objective, int(floor(bound + 1e-6)))
+
+    def extractAssignments(self):
         # Convert the variables to their values
-        for c in range(self.C):
-            for s in range(self.S):
-                self.studentAssignments[s][c] = int(self.studentAssignments[s][c].varValue)
-
-        # Output Results
-        numFirstChoiceAssignment = 0
-        numSecondChoiceAssignment = 0
-        numThirdChoiceAssignment = 0
-        numNoChoiceAssignment = 0
-        numNoAssignment = 0
-        numMultiAssignment = 0
-        self.studentIdAssignments = [[-1] for s in range(self.S)]
-        courseSizes = [0 for c in range(self.C)]
-        courseFirstChoices = [0 for c in range(self.C)]
-        courseSecondChoices = [0 for c in range(self.C)]
-        courseThirdChoices = [0 for c in range(self.C)]
-        courseAssignedFirstChoices = [0 for c in range(self.C)]
-        courseAssignedSecondChoices = [0 for c in range(self.C)]
-        courseAssignedThirdChoices = [0 for c in range(self.C)]
+        students = []
+        courses = []
+        if not self.hasSolution():
+            self.setAssignments(students, courses)
+            return
         for s in range(self.S):
-            firstChoice = self.studentFirstChoices[s]
-            secondChoice = self.studentSecondChoices[s]
-            thirdChoice = self.studentThirdChoices[s]
-            sumAssignments = 0
             for c in range(self.C):
-                # Courses Stats
-                courseId = c + 1
-                # total choice and assigned choice
-                if (courseId == firstChoice):
-                    courseFirstChoices[c] += 1
-                    if (self.studentAssignments[s][c] == 1):
-                        courseAssignedFirstChoices[c] += 1
-                elif (courseId == secondChoice):
-                    courseSecondChoices[c] += 1
-                    if (self.studentAssignments[s][c] == 1):
-                        courseAssignedSecondChoices[c] += 1
-                elif (courseId == thirdChoice):
-                    courseThirdChoices[c] += 1
-                    if (self.studentAssignments[s][c] == 1):
-                        courseAssignedThirdChoices[c] += 1
-                if (self.studentAssignments[s][c] == 1):
-                    courseSizes[c] += 1
-
-                # Students Stats
-                if (self.studentAssignments[s][c] == 1):
-                    if (courseId == firstChoice):
-                        numFirstChoiceAssignment += 1
-                    elif (courseId == secondChoice):
-                        numSecondChoiceAssignment += 1
-                    elif (courseId == thirdChoice):
-                        numThirdChoiceAssignment += 1
-                    else:
-                        numNoChoiceAssignment += 1
-                    sumAssignments += 1
-                    if self.studentIdAssignments[s][0] == -1:
-                        self.studentIdAssignments[s][0] = courseId
-                    else:
-                        self.studentIdAssignments[s].append(courseId)
-            if sumAssignments > 1:
-                numMultiAssignment += 1
-            elif sumAssignments == 0:
-                numNoAssignment += 1
-
-        # Print some stats
-        solutionStat = ('Solution Status: %s' % self.status)
-        prefobj = self.c1Value * numFirstChoiceAssignment + self.c2Value * numSecondChoiceAssignment + self.c3Value * numThirdChoiceAssignment
-        totalWeightStat = ('Total Course Weight Achieved: %.5f (%d/%d)'
-              % (float(prefobj) / (self.S*self.c1Value), prefobj, self.S*self.c1Value))
-        firstChoiceStat = ('First Choice Assignments: %.5f (%d/%d)'
-              % (float(numFirstChoiceAssignment) / self.S, numFirstChoiceAssignment, self.S))
-        secondChoiceStat = ('Second Choice Assignments: %.5f (%d/%d)'
-              % (float(numSecondChoiceAssignment) / self.S, numSecondChoiceAssignment, self.S))
-        thirdChoiceStat = ('Third Choice Assignments: %.5f (%d/%d)'
-              % (float(numThirdChoiceAssignment) / self.S, numThirdChoiceAssignment, self.S))
-        noChoiceStat = ('No Choice Assignments: %.5f (%d/%d)'
-              % (float(numNoChoiceAssignment) / self.S, numNoChoiceAssignment, self.S))
-        multiChoiceStat = ('Multi Assignments: %.5f (%d/%d)'
-              % (float(numMultiAssignment) / self.S, numMultiAssignment, self.S))
-        noAssignmentStat = ('No Assignments: %.5f (%d/%d)'
-              % (float(numNoAssignment) / self.S, numNoAssignment, self.S))
-        print(totalWeightStat)
-        print(firstChoiceStat)
-        print(secondChoiceStat)
-        print(thirdChoiceStat)
-        print(noChoiceStat)
-        print(multiChoiceStat)
-        print(noAssignmentStat)
+                if (self.studentAssignments[s][c].varValue or 0) > 0.5:
+                    students.append(s)
+                    courses.append(c)
+        self.setAssignments(students, courses)
+
+    def outputResults(self, directory='.'):
+        with self.profile.phase('outputResults'):
+            # Output Results
+            # Every stat comes from the compact assignment (course index per student, -1 for none) and
+            # the preference edges, where a student's rank for a course is the first time they listed it
+            students, courses, weights, ranks = self.preferenceEdges()
+            assigned = self.assignment >= 0
+            assignedEdges = self.assignment[students] == courses
+
+            courseSizes = np.bincount(self.assignment[assigned], minlength=self.C)
+            courseChoices = [np.bincount(courses[ranks == rank], minlength=self.C) for rank in (1, 2, 3)]
+            courseAssignedChoices = [np.bincount(courses[(ranks == rank) & assignedEdges], minlength=self.C)
+                                     for rank in (1, 2, 3)]
+            numFirstChoiceAssignment, numSecondChoiceAssignment, numThirdChoiceAssignment = [
+                int(courseAssigned.sum()) for courseAssigned in courseAssignedChoices]
+            numNoChoiceAssignment = int(np.count_nonzero(assigned)) - int(np.count_nonzero(assignedEdges))
+            numNoAssignment = int(np.count_nonzero(~assigned))
+
+            # Collect the results
+            self.results = MatchResults(self.status)
+            self.results.profile = self.profile
+            self.results.objective = self.objectiveValue()
+            self.results.bound = self.objectiveBound(self.results.objective)
+            prefobj = self.c1Value * numFirstChoiceAssignment + self.c2Value * numSecondChoiceAssignment + self.c3Value * numThirdChoiceAssignment
+            self.results.addStat('Total Course Weight Achieved', prefobj, self.S * self.c1Value)
+            self.results.addStat('First Choice Assignments', numFirstChoiceAssignment, self.S)
+            self.results.addStat('Second Choice Assignments', numSecondChoiceAssignment, self.S)
+            self.results.addStat('Third Choice Assignments', numThirdChoiceAssignment, self.S)
+            self.results.addStat('No Choice Assignments', numNoChoiceAssignment, self.S)
+            self.results.addStat('Multi Assignments', self.numMultiAssignment, self.S)
+            self.results.addStat('No Assignments', numNoAssignment, self.S)
+            for stat in self.results.stats:
+                print(stat)
+
+            c1, c2, c3 = courseChoices
+            ca1, ca2, ca3 = courseAssignedChoices
+            self.results.courses = ResultTable.fromColumns(COURSE_COLUMNS, [
+                list(range(1, self.C + 1)),  # 'Course number'
+                list(self.courseNames),  # 'Course name'
+                (c1 + c2 + c3).tolist(),  # 'Total Choices'
+                c1.tolist(),  # 'Total First choices'
+                c2.tolist(),  # 'Total Second choices'
+                c3.tolist(),  # 'Total Third choices'
+                (self.c1Value * c1 + self.c2Value * c2 + self.c3Value * c3).tolist(),  # 'Weight'
+                self.courseMins.tolist(),  # 'Minimum class size'
+                self.courseMaxs.tolist(),  # 'Maximum class size'
+                courseSizes.tolist(),  # 'Students assigned'
+                ca1.tolist(),  # 'Assigned First choices'
+                ca2.tolist(),  # 'Assigned Second choices'
+                ca3.tolist(),  # 'Assigned Third choices'
+                (self.c1Value * ca1 + self.c2Value * ca2 + self.c3Value * ca3).tolist(),  # 'Assigned Weight'
+            ])
+
+            self.results.placeable = self.analysis.placeable
+            bottleneckCourses = np.array([c for c, reason in self.analysis.bottlenecks], dtype=np.int64)
+            self.results.bottlenecks = ResultTable.fromColumns(BOTTLENECK_COLUMNS, [
+                (bottleneckCourses + 1).tolist(),  # 'Course number'
+                [self.courseNames[c] for c in bottleneckCourses],  # 'Course name'
+                self.courseMins[bottleneckCourses].tolist(),  # 'Minimum class size'
+                self.courseMaxs[bottleneckCourses].tolist(),  # 'Maximum class size'
+                c1[bottleneckCourses].tolist(),  # 'Total First choices'
+                (c1 + c2 + c3)[bottleneckCourses].tolist(),  # 'Total Choices'
+                [reason for c, reason in self.analysis.bottlenecks],  # 'Bottleneck'
+            ])
+
+            bulletVoting = ~uniqueChoiceMask(self.choices)
+            self.results.assignedStudents = ResultTable.fromColumns(
+                ASSIGNED_STUDENT_COLUMNS, self.studentColumns(np.flatnonzero(assigned), True))
+            self.results.unassignedStudents = ResultTable.fromColumns(
+                STUDENT_COLUMNS, self.studentColumns(np.flatnonzero(~assigned), False))
+            self.results.bulletVotingStudents = ResultTable.fromColumns(
+                ASSIGNED_STUDENT_COLUMNS, self.studentColumns(np.flatnonzero(bulletVoting), True))
+
+            self.writeOutputFiles()
+            self.outputFiles = self.results.files
+
+            if directory is not None:
+                for fileName, data in self.outputFiles.items():
+                    with open(os.path.join(directory, fileName), mode='wb') as output_file:
+                        output_file.write(data)
+
+    def studentColumns(self, students, withAssignment):
+        # Columns of a student table for the given student indexes
+        columns = [
+            (students + 1).tolist(),  # 'Student ID'
+            [self.studentFirstName[s] for s in students],  # 'First Name'
+            [self.studentLastName[s] for s in students],  # 'Last Name'
+            [self.studentFirstChoices[s] for s in students],  # 'First choice'
+            [self.studentSecondChoices[s] for s in students],  # 'Second choice'
+            [self.studentThirdChoices[s] for s in students],  # 'Third choice'
+        ]
+        if withAssignment:
+            courseIds = np.where(self.assignment[students] >= 0, self.assignment[students] + 1, -1)
+            columns.append(["%d" % courseId for courseId in courseIds])  # 'Course Assignment'
+        return columns
+
+    def writeCSV(self, fileName, table):
+        with StringIO() as table_file:
+            table_writer = writer(table_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator='\n')
+            table_writer.writerow(table.columns)
+            table_writer.writerows(table.rows())
+            self.results.files[fileName] = table_file.getvalue().encode('utf-8')
+
+    def writeOutputFiles(self):
+        # Output to CSV
+        self.writeCSV('Output_Courses.csv', self.results.courses)
+        self.writeCSV('Output_Assigned_Students.csv', self.results.assignedStudents)
+        self.writeCSV('Output_BulletVoting_Students.csv', self.results.bulletVotingStudents)
+        self.writeCSV('Output_Unassigned_Students.csv', self.results.unassignedStudents)
+        with StringIO() as stats_file:
+            stats_writer = writer(stats_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator='\n')
+            stats_writer.writerows([row] for row in self.results.statLines())
+            self.results.files['Output_Stats.csv'] = stats_file.getvalue().encode('utf-8')
 
         # Output to xlsx
-        workbook = xlsxwriter.Workbook('Output_Assignment.xlsx', {'strings_to_numbers':  True})
-        workbook.add_worksheet("Courses")
-        workbook.add_worksheet("Student Assignments")
-        workbook.add_worksheet("Student Unassignments")
-        workbook.add_worksheet("Stats")
+        workbookData = BytesIO()
+        workbook = xlsxwriter.Workbook(workbookData, {'strings_to_numbers':  True, 'in_memory': True})
 
         # Add a format. Light red fill with dark red text.
         highlight_red = workbook.add_format({'bg_color': '#FFC7CE',
@@ -294,188 +679,42 @@ class Matcher:
                                        'font_color': '#006100'})
         text_red = workbook.add_format({'font_color': '#FF0000'})
 
-        # Output to CSV
-        with open('Output_Courses.csv', mode='w', encoding='utf-8') as course_file:
-            course_writter = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL,
-                                    lineterminator='\n')
-            worksheet = workbook.get_worksheet_by_name("Courses")
-
-            # write column names
-            columnNames = []
-            columnNames.append('Course number')
-            columnNames.append('Course name')
-            columnNames.append('Total Choices')  # 'Total Choices'
-            columnNames.append('Total First choices')
-            columnNames.append('Total Second choices')
-            columnNames.append('Total Third choices')
-            columnNames.append('Weight')
-            columnNames.append('Minimum class size')
-            columnNames.append('Maximum class size')
-            columnNames.append('Students assigned')
-            columnNames.append('Assigned First choices')
-            columnNames.append('Assigned Second choices')
-            columnNames.append('Assigned Third choices')
-            columnNames.append('Assigned Weight')
-            course_writter.writerow(columnNames)
-            worksheet.write_row('A1', columnNames)
-
-            # write row data
-            for c in range(self.C):
-                rowData = []
-                c1 = courseFirstChoices[c]
-                c2 = courseSecondChoices[c]
-                c3 = courseThirdChoices[c]
-                ca1 = courseAssignedFirstChoices[c]
-                ca2 = courseAssignedSecondChoices[c]
-                ca3 = courseAssignedThirdChoices[c]
-
-                rowData.append(c + 1)  # 'Course number'
-                rowData.append(self.courseNames[c])  # 'Course name'
-                rowData.append(c1 + c2 + c3)  # 'Total Choices'
-                rowData.append(c1)  # 'Total First choices'
-                rowData.append(c2)  # 'Total Second choices'
-                rowData.append(c3)  # 'Total Third choices'
-                rowData.append(self.c1Value * c1 + self.c2Value * c2 + self.c3Value * c3)  # 'Weight'
-                rowData.append(self.courseMins[c])  # 'Minimum class size'
-                rowData.append(self.courseMaxs[c])  # 'Maximum class size'
-                rowData.append(courseSizes[c])  # 'Students assigned'
-                rowData.append(ca1)  # 'Assigned First choices'
-                rowData.append(ca2)  # 'Assigned Second choices'
-                rowData.append(ca3)  # 'Assigned Third choices'
-                rowData.append(self.c1Value * ca1 + self.c2Value * ca2 + self.c3Value * ca3)  # 'Assigned Weight'
-                course_writter.writerow(rowData)
-                worksheet.write_row(c+1, 0, rowData)
-
-        with open('Output_Assigned_Students.csv', mode='w', encoding='utf-8') as course_file:
-            student_writer = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL,
-                                    lineterminator='\n')
-            worksheet = workbook.get_worksheet_by_name("Student Assignments")
-
-            # write column names
-            columnNames = []
-            columnNames.append('Student ID')
-            columnNames.append('First Name')
-            columnNames.append('Last Name')
-            columnNames.append('First choice')
-            columnNames.append('Second choice')
-            columnNames.append('Third choice')
-            columnNames.append('Course Assignment')
-            student_writer.writerow(columnNames)
-            worksheet.write_row('A1', columnNames)
-
-            # write row data
-            row = 1
-            for s in range(self.S):
-                if (self.studentIdAssignments[s][0] != -1):
-                    ca = "%d" % self.studentIdAssignments[s][0]
-                    for i in range(1, len(self.studentIdAssignments[s])):
-                        ca += ", %d" % self.studentIdAssignments[s][i]
-
-                    rowData = []
-                    rowData.append(s + 1)  # 'Student ID'
-                    rowData.append(self.studentFirstName[s])  # 'First Name'
-                    rowData.append(self.studentLastName[s])  # 'Last Name'
-                    rowData.append(self.studentFirstChoices[s])  # 'First choice'
-                    rowData.append(self.studentSecondChoices[s])  # 'Second choice'
-                    rowData.append(self.studentThirdChoices[s])  # 'Third choice'
-                    rowData.append(ca)  # 'Course Assignment'
-                    student_writer.writerow(rowData)
-                    worksheet.write_row(row, 0, rowData)
-                    row += 1
-            worksheet.conditional_format('$G$2:$G$1048576', {'type': 'formula',
-                                                'criteria': '=$G2=$D2',
-                                                'format': highlight_green})
-            worksheet.conditional_format('$G$2:$G$1048576', {'type': 'formula',
-                                                'criteria': '=$G2=$E2',
-                                                'format': highlight_yellow})
-            worksheet.conditional_format('$G$2:$G$1048576', {'type': 'formula',
-                                                'criteria': '=$G2=$F2',
-                                                'format': highlight_red})
-            worksheet.conditional_format('$D$2:$F$1048576', {'type': 'formula',
-                                                'criteria': '=OR($D2=$E2,$D2=$F2,$E2=$F2,TYPE($D2)<>1,TYPE($E2)<>1,TYPE($F2)<>1)',
-                                                'format': text_red})
-
-        with open('Output_BulletVoting_Students.csv', mode='w', encoding='utf-8') as course_file:
-            student_writer = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL,
-                                    lineterminator='\n')
-            # write column names
-            columnNames = []
-            columnNames.append('Student ID')
-            columnNames.append('First Name')
-            columnNames.append('Last Name')
-            columnNames.append('First choice')
-            columnNames.append('Second choice')
-            columnNames.append('Third choice')
-            columnNames.append('Course Assignment')
-            student_writer.writerow(columnNames)
-
-            # write row data
-            for s in range(self.S):
-                ca = "%d" % self.studentIdAssignments[s][0]
-                for i in range(1, len(self.studentIdAssignments[s])):
-                    ca += ", %d" % self.studentIdAssignments[s][i]
-                c1 = self.studentFirstChoices[s]
-                c2 = self.studentSecondChoices[s]
-                c3 = self.studentThirdChoices[s]
-
-                if self.notUniqueChoices(c1, c2, c3):
-                    rowData = []
-                    rowData.append(s + 1)  # 'Student ID'
-                    rowData.append(self.studentFirstName[s])  # 'First Name'
-                    rowData.append(self.studentLastName[s])  # 'Last Name'
-                    rowData.append(c1)  # 'First choice'
-                    rowData.append(c2)  # 'Second choice'
-                    rowData.append(c3)  # 'Third choice'
-                    rowData.append(ca)  # 'Course Assignment'
-                    student_writer.writerow(rowData)
-
-        with open('Output_Unassigned_Students.csv', mode='w', encoding='utf-8') as course_file:
-            student_writer = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL,
-                                    lineterminator='\n')
-            worksheet = workbook.get_worksheet_by_name("Student Unassignments")
-            # write column names
-            columnNames = []
-            columnNames.append('Student ID')
-            columnNames.append('First Name')
-            columnNames.append('Last Name')
-            columnNames.append('First choice')
-            columnNames.append('Second choice')
-            columnNames.append('Third choice')
-            student_writer.writerow(columnNames)
-            worksheet.write_row('A1', columnNames)
-
-            # write row data
-            row = 1
-            for s in range(self.S):
-                if (self.studentIdAssignments[s][0] == -1):
-                    rowData = []
-                    rowData.append(s + 1)  # 'Student ID'
-                    rowData.append(self.studentFirstName[s])  # 'First Name'
-                    rowData.append(self.studentLastName[s])  # 'Last Name'
-                    rowData.append(self.studentFirstChoices[s])  # 'First choice'
-                    rowData.append(self.studentSecondChoices[s])  # 'Second choice'
-                    rowData.append(self.studentThirdChoices[s])  # 'Third choice'
-                    student_writer.writerow(rowData)
-                    worksheet.write_row(row, 0, rowData)
-                    row += 1
-            worksheet.conditional_format('$D$2:$F$1048576', {'type': 'formula',
-                                                'criteria': '=OR($D2=$E2,$D2=$F2,$E2=$F2,TYPE($D2)<>1,TYPE($E2)<>1,TYPE($F2)<>1)',
-                                                'format': text_red})
-
-        with open('Output_Stats.csv', mode='w', encoding='utf-8') as course_file:
-            stats_writer = writer(course_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator='\n')
-            worksheet = workbook.get_worksheet_by_name("Stats")
-
-            # write column names
-
-            rows = [solutionStat, totalWeightStat, firstChoiceStat, secondChoiceStat, thirdChoiceStat, noChoiceStat, multiChoiceStat, noAssignmentStat]
-            for row in rows:
-                stats_writer.writerow([row])
-            worksheet.write_column('A1', rows)
+        worksheet = workbook.add_worksheet("Courses")
+        worksheet.write_row('A1', self.results.courses.columns)
+        for row, rowData in enumerate(self.results.courses.rows()):
+            worksheet.write_row(row + 1, 0, rowData)
+
+        worksheet = workbook.add_worksheet("Student Assignments")
+        worksheet.write_row('A1', self.results.assignedStudents.columns)
+        for row, rowData in enumerate(self.results.assignedStudents.rows()):
+            worksheet.write_row(row + 1, 0, rowData)
+        worksheet.conditional_format('$G$2:$G$1048576', {'type': 'formula',
+                                            'criteria': '=$G2=$D2',
+                                            'format': highlight_green})
+        worksheet.conditional_format('$G$2:$G$1048576', {'type': 'formula',
+                                            'criteria': '=$G2=$E2',
+                                            'format': highlight_yellow})
+        worksheet.conditional_format('$G$2:$G$1048576', {'type': 'formula',
+                                            'criteria': '=$G2=$F2',
+                                            'format': highlight_red})
+        worksheet.conditional_format('$D$2:$F$1048576', {'type': 'formula',
+                                            'criteria': '=OR($D2=$E2,$D2=$F2,$E2=$F2,TYPE($D2)<>1,TYPE($E2)<>1,TYPE($F2)<>1,ISBLANK($D2),ISBLANK($E2),ISBLANK($F2))',
+                                            'format': text_red})
+
+        worksheet = workbook.add_worksheet("Student Unassignments")
+        worksheet.write_row('A1', self.results.unassignedStudents.columns)
+        for row, rowData in enumerate(self.results.unassignedStudents.rows()):
+            worksheet.write_row(row + 1, 0, rowData)
+        worksheet.conditional_format('$D$2:$F$1048576', {'type': 'formula',
+                                            'criteria': '=OR($D2=$E2,$D2=$F2,$E2=$F2,TYPE($D2)<>1,TYPE($E2)<>1,TYPE($F2)<>1,ISBLANK($D2),ISBLANK($E2),ISBLANK($F2))',
+                                            'format': text_red})
+
+        worksheet = workbook.add_worksheet("Stats")
+        worksheet.write_column('A1', self.results.statLines())
 
         # done outputting
         workbook.close()
-
+        self.results.files['Output_Assignment.xlsx'] = workbookData.getvalue()
 
 class HardConstraintMatcher(Matcher):
     def initVariables(self):
@@ -508,16 +747,6 @@ class HardConstraintMatcher(Matcher):
         #     constraint = self.classWillRun[c] - self.sumStudentsInClass[c]
         #     sizeConstraints[c] = LpConstraint(e=constraint, sense=-1, name="C%ds"%c, rhs=0)
 
-        # Constraints for each class
-        classConstraints = [[LpConstraint() for c in range(self.C)] for i in range(2)]
-        for c in range(self.C):
-            hardMin = self.sumStudentsInClass[c] - self.courseMins[c] * self.classWillRun[c]
-            hardMax = self.sumStudentsInClass[c] - self.courseMaxs[c] * self.classWillRun[c]
-            minConstraint = LpConstraint(e=hardMin, sense=1, name="C%dm" % c, rhs=0)
-            maxConstraint = LpConstraint(e=hardMax, sense=-1, name="C%dM" % c, rhs=0)
-            classConstraints[0][c] = minConstraint
-            classConstraints[1][c] = maxConstraint
-
         # Constraint limiting the number of classes a student should be assigned to
         maxAssignmentConstraint = [LpConstraint() for s in range(self.S)]
         for s in range(self.S):
@@ -540,10 +769,235 @@ class HardConstraintMatcher(Matcher):
             self.model += maxAssignmentConstraint[s]
         for s in range(self.S):
             self.model += prefAssignmentConstraint[s]
+        # Dr. Miller's Constraints
+        # for c in range(self.C):
+        #     for s in range(self.S):
+        #         self.model += runConstraints[c][s]
+        #     self.model += sizeConstraints[c]
+        self.addClassConstraints()
+        self.addLinkingConstraints()
+
+    def setStart(self, start):
+        super(HardConstraintMatcher, self).setStart(start)
+        isOpen = np.bincount(start[start >= 0], minlength=self.C) > 0
+        for c in range(self.C):
+            self.classWillRun[c].setInitialValue(int(isOpen[c]))
+
+    def fixPresolved(self):
+        super(HardConstraintMatcher, self).fixPresolved()
+        for c in np.flatnonzero(self.presolved.closedCourses):
+            self.classWillRun[c].upBound = 0
+
+    def addLinkingConstraints(self):
+        # Dr. Miller's run constraints, only for the pairs the LP relaxation violates
+        if not self.linkingCuts:
+            return
+        for s, c in zip(*self.linkingPairs()):
+            constraint = self.studentAssignments[s][c] - self.classWillRun[c]
+            self.model += LpConstraint(e=constraint, sense=-1, name="C%dS%dr" % (c, s), rhs=0)
+
+    def addClassConstraints(self):
+        # Constraints for each class, kept so a SolveSession can change their sizes (see session.py)
+        self.classConstraints = classConstraints = [[LpConstraint() for c in range(self.C)] for i in range(2)]
+        for c in range(self.C):
+            hardMin = self.sumStudentsInClass[c] - int(self.courseMins[c]) * self.classWillRun[c]
+            hardMax = self.sumStudentsInClass[c] - int(self.courseMaxs[c]) * self.classWillRun[c]
+            minConstraint = LpConstraint(e=hardMin, sense=1, name="C%dm" % c, rhs=0)
+            maxConstraint = LpConstraint(e=hardMax, sense=-1, name="C%dM" % c, rhs=0)
+            classConstraints[0][c] = minConstraint
+            classConstraints[1][c] = maxConstraint
+
+        # Add constraints to model
         for c in range(self.C):
-            # Dr. Miller's Constraints
-            # for s in range(self.S):
-            #     self.model += runConstraints[c][s]
-            # self.model += sizeConstraints[c]
             for i in range(len(classConstraints)):
                 self.model += classConstraints[i][c]
+
+
+class SparseHardConstraintMatcher(HardConstraintMatcher):
+    """
+    Same model as HardConstraintMatcher, but a student only gets an assignment variable for each
+    course they actually listed as P1, P2 or P3. Every other (student, course) pair is fixed to 0
+    by construction, so the model needs no prefAssignmentConstraint and grows with S * 3 instead
+    of S * C.
+
+    studentAssignments[s] and studentPreferences[s] are dicts keyed by course index.
+    """
+
+    def studentCourses(self, s):
+        # Course indexes a student listed, without repeats or ids that don't name a course
+        courses = []
+        for choice in (self.studentFirstChoices[s], self.studentSecondChoices[s], self.studentThirdChoices[s]):
+            if isinstance(choice, int) and 1 <= choice <= self.C and (choice - 1) not in courses:
+                courses.append(choice - 1)
+        return courses
+
+    def initVariables(self):
+        self.studentAssignments = [{c: LpVariable("S%dC%d" % (s, c), 0, 1, LpInteger)
+                                    for c in self.studentCourses(s)} for s in range(self.S)]
+        self.classWillRun = [LpVariable("C%dr" % c, 0, 1, LpInteger)
+                             for c in range(self.C)]
+
+    def makeObjective(self):
+        self.studentPreferences = [{} for s in range(self.S)]
+        for s in range(self.S):
+            c1 = self.studentFirstChoices[s]
+            c2 = self.studentSecondChoices[s]
+            c3 = self.studentThirdChoices[s]
+
+            uniqueChoices = 0 if self.notUniqueChoices(c1, c2, c3) else 1
+
+            for choice, choiceValue in ((c1, self.c1Value), (c2, self.c2Value), (c3, self.c3Value)):
+                if isinstance(choice, int) and (choice - 1) in self.studentAssignments[s]:
+                    self.studentPreferences[s][choice - 1] = (choiceValue - 1) * uniqueChoices + 1
+
+        objective = LpAffineExpression()
+        for s in range(self.S):
+            for c, assignment in self.studentAssignments[s].items():
+                objective += self.studentPreferences[s][c] * assignment
+
+        # Add objective to model
+        self.model += objective
+
+    def makeConstraints(self):
+        self.sumStudentsInClass = [LpAffineExpression() for c in range(self.C)]
+        for s in range(self.S):
+            for c, assignment in self.studentAssignments[s].items():
+                self.sumStudentsInClass[c] += assignment
+
+        # Constraint limiting the number of classes a student should be assigned to
+        for s in range(self.S):
+            if self.studentAssignments[s]:
+                sumOfAssignments = LpAffineExpression()
+                for assignment in self.studentAssignments[s].values():
+                    sumOfAssignments += assignment
+                self.model += sumOfAssignments <= 1
+
+        self.addClassConstraints()
+        self.addLinkingConstraints()
+
+    def extractAssignments(self):
+        students = []
+        courses = []
+        if not self.hasSolution():
+            self.setAssignments(students, courses)
+            return
+        for s in range(self.S):
+            for c, assignment in self.studentAssignments[s].items():
+                if (assignment.varValue or 0) > 0.5:
+                    students.append(s)
+                    courses.append(c)
+        self.setAssignments(students, courses)
+
+
+class MatrixHardConstraintMatcher(Matcher):
+    """
+    The SparseHardConstraintMatcher model built as NumPy arrays and a sparse constraint matrix
+    (see matrixmodel.py) instead of PuLP expressions. The MPS file is written straight from the
+    arrays and CBC's solution is mapped back to students and courses by column index.
+
+    With solve(workers=N) for N > 1, a model whose preference graph splits into independent clusters
+    is solved as up to N parts in parallel processes (see decompose.py); matcher.parts describes them.
+    """
+
+    def initProblem(self):
+        students, courses, weights, ranks, courseMins, courseMaxs = self.modelEdges()
+        self.model = AssignmentModel(students, courses, weights, self.S, courseMins, courseMaxs)
+
+    def solveModel(self, solver, timeLimit, gapTarget=None, warmStart=True):
+        with self.profile.phase('buildModel'):
+            self.initProblem()
+            if self.linkingCuts:
+                self.printLinkingCuts(self.model.addLinkingCuts())
+        self.profile.setModelSize(self.model.numColumns, self.model.numRows, self.model.matrix.nnz)
+        startValues = self.startValues(self.greedyStart()) if warmStart else None
+        solverPath = None if solver == HIGHS else getSolver(CBC if solver == PORTFOLIO else solver).path
+        with self.profile.phase('solver'):
+            if self.workers > 1:
+                self.status, self.solution, self.bound, self.parts = solveDecomposed(
+                    self.model, solver, solverPath, timeLimit, gapTarget, startValues, self.workers)
+                for part in self.parts:
+                    print("Part: %(components)d components, %(students)d students, %(courses)d courses, "
+                          "%(status)s, objective %(objective)g, %(seconds).2fs" % part)
+            else:
+                self.status, self.solution, self.bound = self.model.solveWith(solver, solverPath, timeLimit,
+                                                                              gapTarget, startValues)
+                self.nodes = self.model.nodes
+        if self.bound is not None:
+            self.bound += self.fixedWeight()
+        print("Status:", self.status)
+        print("Objective value: ", self.model.objectiveValue(self.solution) + self.fixedWeight())
+        with self.profile.phase('extractAssignments'):
+            self.extractAssignments()
+
+    def startValues(self, start):
+        # Column values of the model for a course index per student
+        values = np.zeros(self.model.numColumns)
+        values[:self.model.E] = self.startEdgeValues(start)
+        values[self.model.E:] = np.bincount(start[start >= 0], minlength=self.C) > 0
+        return values
+
+    def startEdgeValues(self, start):
+        return start[self.model.students] == self.model.courses
+
+    def extractAssignments(self):
+        self.setAssignments(*self.withFixed(*self.model.assignedPairs(self.solution)))
+
+
+class AggregatedHardConstraintMatcher(MatrixHardConstraintMatcher):
+    """
+    Students with the same (P1, P2, P3) profile are interchangeable, so they are grouped and the model
+    gets one integer variable per (profile, listed course) counting how many of the group take that
+    course, bounded by the group size. This removes the symmetry between identical students that
+    makes CBC branch for the whole time limit, and shrinks the model to the number of distinct profiles.
+
+    Counts are split back to students deterministically: within a profile, students in file order fill
+    the P1 course first, then P2, then P3.
+    """
+
+    def initProblem(self):
+        profiles, studentProfiles = np.unique(self.choices, axis=0, return_inverse=True)
+        self.studentProfiles = studentProfiles.ravel()
+        self.numProfiles = len(profiles)
+
+        # Groups only count the students the model places, the ones presolve or a stable re-solve
+        # didn't fix, and a profile's edges are the edges of its first such student
+        self.modelStudents = np.ones(self.S, dtype=bool) if self.presolved is None else self.presolved.fixed < 0
+        placed = np.flatnonzero(self.modelStudents)
+        placedProfiles, firstPlaced = np.unique(self.studentProfiles[placed], return_index=True)
+        profileSizes = np.bincount(self.studentProfiles[placed], minlength=self.numProfiles)
+        students, courses, weights, ranks, courseMins, courseMaxs = self.modelEdges()
+        isFirstStudent = np.zeros(self.S, dtype=bool)
+        isFirstStudent[placed[firstPlaced]] = True
+        profileEdges = isFirstStudent[students]
+        self.model = AssignmentModel(self.studentProfiles[students[profileEdges]], courses[profileEdges],
+                                     weights[profileEdges], self.numProfiles, courseMins, courseMaxs,
+                                     groupSizes=profileSizes)
+        print("Profiles: %d distinct for %d students" % (self.numProfiles, self.S))
+
+    def startEdgeValues(self, start):
+        # How many students of each profile the start puts in each of the profile's courses
+        assigned = (start >= 0) & self.modelStudents
+        if not assigned.any():
+            return np.zeros(self.model.E)
+        startKeys, startCounts = np.unique(self.studentProfiles[assigned] * self.C + start[assigned],
+                                           return_counts=True)
+        edgeKeys = self.model.students * self.C + self.model.courses
+        position = np.minimum(np.searchsorted(startKeys, edgeKeys), len(startKeys) - 1)
+        return np.where(startKeys[position] == edgeKeys, startCounts[position], 0)
+
+    def extractAssignments(self):
+        # Students of each profile the model placed, in file order
+        profileMembers = [[] for p in range(self.numProfiles)]
+        for s in np.flatnonzero(self.modelStudents).tolist():
+            profileMembers[self.studentProfiles[s]].append(s)
+        nextMember = [0 for p in range(self.numProfiles)]
+
+        students = []
+        courses = []
+        counts = self.model.edgeCounts(self.solution)
+        for p, c, count in zip(self.model.students, self.model.courses, counts):
+            members = profileMembers[p][nextMember[p]:nextMember[p] + count]
+            students += members
+            courses += [c] * len(members)
+            nextMember[p] += count
+        self.setAssignments(*self.withFixed(students, courses))
@@ -0,0 +1,444 @@
+'''
+Matrix form of the hard constraint assignment model.
+
+Instead of growing LpAffineExpression objects one term at a time, the model is described by arrays:
+    -preference edges: one (student, course, weight, rank) entry per distinct course a student listed
+    -columns: one binary assignment per edge, followed by one binary classWillRun per course
+    -rows: one "at most one course" row per student, then a min row and a max row per course
+The MPS file for the solver is written straight from these arrays and the solution is read back
+by column index, so no PuLP variables or expressions are ever created.
+'''
+
+import os
+import re
+import subprocess
+from queue import Queue
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, linprog, milp
+from scipy.sparse import coo_matrix, vstack
+
+from portfolio import Racer, portfolioConfigurations
+
+# Solver names AssignmentModel.solveWith takes besides the path of a CBC executable
+HIGHS = "HIGHS"
+PORTFOLIO = "PORTFOLIO"
+
+
+def uniqueChoiceMask(choices):
+    # The vectorized opposite of Matcher.notUniqueChoices, missing choices are 0
+    return ((choices[:, 0] != choices[:, 1]) & (choices[:, 0] != choices[:, 2])
+            & (choices[:, 1] != choices[:, 2]) & (choices != 0).all(axis=1))
+
+
+def preferenceEdges(choices, C, c1Value, c2Value, c3Value):
+    """
+    Takes the S x 3 choice array (see ingest.Roster) and returns (students, courses, weights, ranks)
+    arrays with one entry per distinct course a student listed. Courses are 0-based indexes, ranks
+    are 1, 2 or 3. Weights match Matcher.makeObjective: a student without three unique choices gets
+    a weight of 1 for every course they listed.
+    """
+    uniqueChoices = uniqueChoiceMask(choices)
+    choiceValues = np.array([c1Value, c2Value, c3Value])
+    weights = (choiceValues[None, :] - 1) * uniqueChoices[:, None] + 1
+
+    # Only keep the first time a course is listed and ids that name a course
+    listed = (choices >= 1) & (choices <= C)
+    listed[:, 1] &= choices[:, 1] != choices[:, 0]
+    listed[:, 2] &= (choices[:, 2] != choices[:, 0]) & (choices[:, 2] != choices[:, 1])
+
+    students, ranks = np.nonzero(listed)
+    return students, choices[students, ranks] - 1, weights[students, ranks], ranks + 1
+
+
+def cbcBound(log):
+    """
+    The best bound CBC proved for the maximum, read from its log, or None if it didn't print one. CBC reports bounds in its minimization sense, with
+    the sign flipped, so the bound is its absolute value; assignment objectives are never negative.
+    """
+    # The final summary, progress lines and the root node after cuts; the last one is the tightest
+    bounds = re.findall(r"^Lower bound:\s+(\S+)|best possible (-?[0-9.e+]+)"
+                        r"|changed objective from \S+ to (-?[0-9.e+]+)", log, re.MULTILINE)
+    if not bounds:
+        return None
+    return abs(float(next(bound for bound in bounds[-1] if bound)))
+
+
+def cbcNodes(log):
+    # Branch and bound nodes CBC explored, None if its log doesn't say
+    nodes = re.findall(r"^Enumerated nodes:\s+(\d+)", log, re.MULTILINE)
+    return int(nodes[-1]) if nodes else None
+
+
+def mpsNames(prefix, count, width=8):
+    # prefix0, prefix1, ... as byte strings, space padded to the fixed MPS field width
+    return np.array([b"%-*s" % (width, b"%s%d" % (prefix, i)) for i in range(count)], dtype=bytes)
+
+
+def mpsNumbers(values):
+    # Values as MPS byte strings, each distinct value formatted once
+    distinct, inverse = np.unique(values, return_inverse=True)
+    return np.array([b"%.12e" % value for value in distinct.tolist()] or [b""], dtype=bytes)[inverse]
+
+
+def mpsLines(*fields):
+    """
+    Lines made of the given fields, each a byte string or an array of them with one per line. The
+    fields go side by side into one byte table and the NUL bytes numpy pads shorter strings with are
+    dropped, so a model with millions of entries is written without formatting its lines one by one.
+    """
+    count = max(np.size(field) for field in fields)
+    if count == 0:
+        return []
+    tables = [np.full(count, field) if np.ndim(field) == 0 else np.asarray(field, dtype=bytes)
+              for field in fields + (b"\n",)]
+    table = np.hstack([field.view(np.uint8).reshape(count, field.itemsize) for field in tables])
+    return [table[table != 0].tobytes().decode()[:-1]]
+
+
+class AssignmentModel:
+    """
+    The hard constraint model as a sparse matrix.
+
+    Columns are [x_0 .. x_E-1, y_0 .. y_C-1] where x_e assigns edge e's student to edge e's course
+    and y_c is classWillRun for course c. Rows are:
+        -S rows:  sum of a student's x          <= 1
+        -C rows:  sum of a course's x - min*y   >= 0
+        -C rows:  sum of a course's x - max*y   <= 0
+
+    If groupSizes is given, each "student" stands for a group of that many interchangeable students:
+    its row limit becomes the group size and its x columns are general integers bounded by it.
+
+    addLinkingCuts appends linking rows x_e - u_e*y_c <= 0 after these, for the edges that need them.
+    """
+
+    def __init__(self, students, courses, weights, S, courseMins, courseMaxs, groupSizes=None):
+        self.students = np.asarray(students)
+        self.courses = np.asarray(courses)
+        self.S = S
+        self.C = len(courseMins)
+        self.E = len(self.students)
+        E, C = self.E, self.C
+        courseMins = np.asarray(courseMins, dtype=float)
+        courseMaxs = np.asarray(courseMaxs, dtype=float)
+        groupSizes = np.ones(S) if groupSizes is None else np.asarray(groupSizes, dtype=float)
+        self.courseMins = courseMins
+        self.courseMaxs = courseMaxs
+        self.groupSizes = groupSizes
+
+        self.objective = np.concatenate([np.asarray(weights, dtype=float), np.zeros(C)])
+
+        edgeColumns = np.arange(E)
+        runColumns = E + np.arange(C)
+        rows = np.concatenate([self.students, S + self.courses, S + C + self.courses,
+                               S + np.arange(C), S + C + np.arange(C)])
+        columns = np.concatenate([edgeColumns, edgeColumns, edgeColumns, runColumns, runColumns])
+        data = np.concatenate([np.ones(3 * E), -courseMins, -courseMaxs])
+        self.matrix = coo_matrix((data, (rows, columns)), shape=(S + 2 * C, E + C)).tocsr()
+        self.matrix.eliminate_zeros()
+
+        self.rowSense = np.array(['L'] * S + ['G'] * C + ['L'] * C)
+        self.rhs = np.concatenate([groupSizes, np.zeros(2 * C)])
+        self.columnUpper = np.concatenate([groupSizes[self.students], np.ones(C)])
+        # Edges with a linking row, and the branch and bound nodes of the last solve
+        self.linkedEdges = np.zeros(0, dtype=np.int64)
+        self.nodes = None
+
+    @property
+    def numColumns(self):
+        return self.E + self.C
+
+    @property
+    def numRows(self):
+        return self.matrix.shape[0]
+
+    def subModel(self, edges):
+        """
+        The model restricted to the given edges, with their students and courses renumbered from 0.
+        Returns (model, columns), where columns[j] is the column of this model that the sub model's
+        column j stands for.
+        """
+        students, localStudents = np.unique(self.students[edges], return_inverse=True)
+        courses, localCourses = np.unique(self.courses[edges], return_inverse=True)
+        model = AssignmentModel(localStudents, localCourses, self.objective[edges], len(students),
+                                self.courseMins[courses], self.courseMaxs[courses],
+                                groupSizes=self.groupSizes[students])
+        model.addLinkingRows(np.flatnonzero(np.isin(edges, self.linkedEdges)))
+        return model, np.concatenate([edges, self.E + courses])
+
+    def objectiveValue(self, values):
+        return float(self.objective @ values)
+
+    def relaxation(self):
+        # (values, objective) of the LP relaxation, (None, None) if the LP fails
+        rowSign = np.where(self.rowSense == 'G', -1.0, 1.0)
+        bounds = np.column_stack([np.zeros(self.numColumns), self.columnUpper])
+        result = linprog(-self.objective, A_ub=self.matrix.multiply(rowSign[:, None]).tocsr(),
+                         b_ub=rowSign * self.rhs, bounds=bounds, method='highs')
+        if result.status != 0:
+            return None, None
+        return result.x, -result.fun
+
+    def relaxationBound(self):
+        # Optimal objective of the LP relaxation, an upper bound on any integer solution (None if the LP fails)
+        return self.relaxation()[1]
+
+    def linkingCoefficients(self, edges):
+        # u_e: the most students an edge can carry once its course runs
+        return np.minimum(self.columnUpper[edges], self.courseMaxs[self.courses[edges]])
+
+    def addLinkingRows(self, edges):
+        # One x_e - u_e*y_c <= 0 row per edge that doesn't have one yet
+        edges = np.setdiff1d(edges, self.linkedEdges)
+        n = len(edges)
+        if n == 0:
+            return
+        rows = np.concatenate([np.arange(n), np.arange(n)])
+        columns = np.concatenate([edges, self.E + self.courses[edges]])
+        data = np.concatenate([np.ones(n), -self.linkingCoefficients(edges)])
+        linking = coo_matrix((data, (rows, columns)), shape=(n, self.numColumns))
+        self.matrix = vstack([self.matrix, linking]).tocsr()
+        self.rowSense = np.concatenate([self.rowSense, np.array(['L'] * n)])
+        self.rhs = np.concatenate([self.rhs, np.zeros(n)])
+        self.linkedEdges = np.union1d(self.linkedEdges, edges)
+
+    def addLinkingCuts(self, maxRounds=10, tolerance=1e-6):
+        """
+        Strengthens the relaxation with linking rows x_e <= u_e*y_c: an edge can only be used if its
+        course runs. With only the min/max rows, the LP can open a course a tiny fraction and still
+        fill it, so the solver branches on fractional course openings. A row for every edge would
+        double the model, so rows are added lazily: the LP relaxation is solved, every edge whose row
+        it violates gets one, and that repeats until nothing is violated or after maxRounds rounds.
+        Returns one (rows added, LP bound before adding them) pair per round.
+        """
+        rounds = []
+        edges = np.arange(self.E)
+        for round in range(maxRounds):
+            values, bound = self.relaxation()
+            if values is None:
+                break
+            violated = edges[values[:self.E] > self.linkingCoefficients(edges) * values[self.E + self.courses]
+                             + tolerance]
+            violated = np.setdiff1d(violated, self.linkedEdges)
+            if len(violated) == 0:
+                break
+            self.addLinkingRows(violated)
+            rounds.append((len(violated), bound))
+        return rounds
+
+    def assignedPairs(self, values):
+        # (students, courses) arrays for every edge set to 1 in a solution
+        assigned = values[:self.E] > 0.5
+        return self.students[assigned], self.courses[assigned]
+
+    def edgeCounts(self, values):
+        # How many students each edge assigns (0 or 1 unless the model is grouped)
+        return values[:self.E].astype(int)
+
+    def writeMPS(self, path):
+        # Fixed MPS layout (names fit in 8 characters), with the objective negated since CBC minimizes
+        lines = ["NAME          TAS", "ROWS", " N  OBJ"]
+        columnNames = mpsNames(b"X", self.numColumns)
+        rowNames = mpsNames(b"R", len(self.rhs))
+        lines += mpsLines(b" ", np.char.encode(self.rowSense), b"  ", np.char.rstrip(rowNames))
+
+        lines.append("COLUMNS")
+        lines.append("    MARK      'MARKER'                 'INTORG'")
+        matrix = self.matrix.tocsc()
+        counts = np.diff(matrix.indptr)
+        # A column with no entries (a course with a maximum of 0) still needs a line, or CBC won't know it.
+        # A column's objective line comes first, then its entries in row order
+        objectiveColumns = np.flatnonzero((self.objective != 0) | (counts == 0))
+        columns = np.concatenate([objectiveColumns, np.repeat(np.arange(self.numColumns), counts)])
+        order = np.argsort(columns, kind='stable')
+        rows = np.concatenate([np.full(len(objectiveColumns), b"OBJ     "), rowNames[matrix.indices]])
+        values = np.concatenate([-self.objective[objectiveColumns], matrix.data])
+        lines += mpsLines(b"    ", columnNames[columns[order]], b"  ", rows[order], b"  ", mpsNumbers(values[order]))
+        lines.append("    MARK      'MARKER'                 'INTEND'")
+
+        lines.append("RHS")
+        rhsRows = np.flatnonzero(self.rhs)
+        lines += mpsLines(b"    RHS       ", rowNames[rhsRows], b"  ", mpsNumbers(self.rhs[rhsRows]))
+
+        lines.append("BOUNDS")
+        binary = self.columnUpper == 1
+        lines += mpsLines(np.where(binary, b" BV BND       ", b" UP BND       "),
+                          np.where(binary, np.char.rstrip(columnNames), np.char.add(columnNames, b"  ")),
+                          np.where(binary, b"", mpsNumbers(self.columnUpper)))
+        lines.append("ENDATA")
+
+        with open(path, mode='w') as mps_file:
+            mps_file.write("\n".join(lines) + "\n")
+
+    def writeMIPStart(self, path, values):
+        # Same layout as a CBC solution file, which is what CBC reads a MIP start from
+        lines = ["Stopped on time - objective value %.12e" % -self.objectiveValue(values)]
+        lines += ["%7d %-8s %15.12g %23d" % (j, "X%d" % j, values[j], 0) for j in range(self.numColumns)]
+        with open(path, mode='w') as mst_file:
+            mst_file.write("\n".join(lines) + "\n")
+
+    def readSolution(self, path):
+        # Same status words PuLP reads from a CBC solution file
+        cbcStatus = {
+            "Optimal": "Optimal",
+            "Infeasible": "Infeasible",
+            "Integer": "Infeasible",
+            "Unbounded": "Unbounded",
+            "Stopped": "Not Solved",
+        }
+        values = np.zeros(self.numColumns)
+        with open(path) as sol_file:
+            statusWords = sol_file.readline().split()
+            for line in sol_file:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # infeasible rows/columns are flagged with **
+                if fields[0] == "**":
+                    fields = fields[1:]
+                if fields[1][0] == "X":
+                    values[int(fields[1][1:])] = float(fields[2])
+
+        status = cbcStatus.get(statusWords[0], "Undefined") if statusWords else "Undefined"
+        # CBC stopped on a limit but kept the best integer solution it found (the incumbent)
+        if status == "Not Solved" and len(statusWords) >= 5 and statusWords[4] == "objective":
+            status = "Feasible"
+        # Without an integer solution the values are the LP relaxation's, so nobody is assigned
+        if status not in ("Optimal", "Feasible"):
+            values = np.zeros(self.numColumns)
+        return status, np.rint(values)
+
+    def solveWith(self, solver, solverPath, timeLimit=None, gapTarget=None, startValues=None):
+        # (status, values, bound) from HiGHS, a race of CBC configurations or CBC at solverPath
+        if solver == HIGHS:
+            return self.solveHiGHS(timeLimit, gapTarget, startValues)
+        if solver == PORTFOLIO:
+            return self.solvePortfolio(solverPath, timeLimit, gapTarget, startValues)[:3]
+        return self.solveCBC(solverPath, timeLimit, gapTarget, startValues)
+
+    def solveHiGHS(self, timeLimit=None, gapTarget=None, startValues=None):
+        """
+        Returns (status, values, bound) like solveCBC, solving the model with HiGHS through
+        scipy.optimize.milp. The arrays go to HiGHS as they are, with no model file in between.
+        scipy can't pass a MIP start on to HiGHS, so startValues are kept instead when HiGHS stops
+        without finding anything better.
+        """
+        lower = np.where(self.rowSense == 'G', self.rhs, -np.inf)
+        upper = np.where(self.rowSense == 'L', self.rhs, np.inf)
+        # HiGHS stops at a 0.01% gap by default, CBC only at a proven optimum. Its presolve can take
+        # minutes on the course min/max rows and barely shrinks the model, so it is skipped.
+        options = {"disp": False, "presolve": False, "mip_rel_gap": 0.0 if gapTarget is None else gapTarget}
+        if timeLimit is not None:
+            options["time_limit"] = timeLimit
+        result = milp(-self.objective, integrality=np.ones(self.numColumns),
+                      bounds=Bounds(np.zeros(self.numColumns), self.columnUpper),
+                      constraints=LinearConstraint(self.matrix, lower, upper), options=options)
+
+        highsStatus = {0: "Optimal", 2: "Infeasible", 3: "Unbounded"}
+        status = highsStatus.get(result.status, "Not Solved")
+        # Stopped on a limit with an incumbent
+        if status == "Not Solved" and result.x is not None:
+            status = "Feasible"
+        values = np.rint(result.x) if result.x is not None else np.zeros(self.numColumns)
+        bound = getattr(result, "mip_dual_bound", None)
+        self.nodes = getattr(result, "mip_node_count", None)
+        print("HiGHS: %s, %s nodes" % (result.message, self.nodes))
+        if status != "Optimal" and startValues is not None and \
+                (result.x is None or self.objectiveValue(startValues) > self.objectiveValue(values)):
+            status, values = "Feasible", startValues
+        return status, values, None if bound is None or not np.isfinite(bound) else abs(bound)
+
+    def cbcArgs(self, solverPath, mpsPath, solPath, timeLimit=None, gapTarget=None, mstPath=None, options=()):
+        args = [solverPath, mpsPath] + list(options)
+        if timeLimit is not None:
+            args += ["-sec", str(timeLimit)]
+        if gapTarget is not None:
+            args += ["-ratioGap", str(gapTarget)]
+        if mstPath is not None:
+            args += ["-mips", mstPath]
+        return args + ["-solve", "-printingOptions", "all", "-solution", solPath]
+
+    def solveCBC(self, solverPath, timeLimit=None, gapTarget=None, startValues=None):
+        """
+        Returns (status, values, bound). Status is "Feasible" when CBC hit the time limit with an
+        incumbent, and bound is the best bound CBC reported (None if it reported none). CBC stops
+        early once the relative gap between the incumbent and the bound is below gapTarget.
+        startValues (one value per column) is given to CBC as a MIP start.
+        """
+        tmpDir = mkdtemp()
+        try:
+            mpsPath = os.path.join(tmpDir, "model.mps")
+            solPath = os.path.join(tmpDir, "model.sol")
+            self.writeMPS(mpsPath)
+            mstPath = None
+            if startValues is not None:
+                mstPath = os.path.join(tmpDir, "model.mst")
+                self.writeMIPStart(mstPath, startValues)
+
+            args = self.cbcArgs(solverPath, mpsPath, solPath, timeLimit, gapTarget, mstPath)
+            log = subprocess.run(args, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            self.nodes = cbcNodes(log)
+
+            status, values = self.readSolution(solPath)
+            return status, values, cbcBound(log)
+        finally:
+            rmtree(tmpDir, ignore_errors=True)
+
+    def solvePortfolio(self, solverPath, timeLimit=None, gapTarget=None, startValues=None, configurations=None):
+        """
+        Races one CBC process per (name, options) configuration (see portfolio.py) on the same model.
+        Returns (status, values, bound, winner) like solveCBC plus the name of the configuration whose
+        solution is returned: the first to prove optimality, at which point the others are killed, or
+        else the best incumbent once they have all stopped. The bound is the best any of them proved.
+        """
+        tmpDir = mkdtemp()
+        try:
+            mpsPath = os.path.join(tmpDir, "model.mps")
+            self.writeMPS(mpsPath)
+            mstPath = None
+            if startValues is not None:
+                mstPath = os.path.join(tmpDir, "model.mst")
+                self.writeMIPStart(mstPath, startValues)
+
+            finished = Queue()
+            racers = []
+            # Racers share the cores, so the time limit is wall time rather than CBC's default CPU time
+            for i, (name, options) in enumerate(configurations or portfolioConfigurations()):
+                solPath = os.path.join(tmpDir, "%d.sol" % i)
+                args = self.cbcArgs(solverPath, mpsPath, solPath, timeLimit, gapTarget, mstPath,
+                                    ["-timeMode", "elapsed"] + list(options))
+                racers.append(Racer(name, args, solPath, finished))
+
+            # Racers in the order they stop, until one proves optimality
+            results = []
+            try:
+                for i in range(len(racers)):
+                    racer = finished.get()
+                    if os.path.exists(racer.solPath):
+                        status, values = self.readSolution(racer.solPath)
+                    else:
+                        status, values = "Undefined", np.zeros(self.numColumns)
+                    results.append((racer, status, values))
+                    if status == "Optimal":
+                        break
+            finally:
+                for racer in racers:
+                    racer.kill()
+
+            solved = [result for result in results if result[1] in ("Optimal", "Feasible")]
+            if solved:
+                # An optimum is always last, and at least as good as any incumbent
+                winner, status, values = max(solved, key=lambda result: (result[1] == "Optimal",
+                                                                         self.objectiveValue(result[2])))
+            else:
+                winner, status, values = results[0]
+            print("Portfolio: %s won with %s" % (winner.name, status))
+            self.nodes = cbcNodes(winner.log)
+
+            # Racers that were killed still proved their bounds so far
+            bounds = [bound for bound in (cbcBound(racer.log) for racer in racers) if bound is not None]
+            return status, values, min(bounds) if bounds else None, winner.name
+        finally:
+            rmtree(tmpDir, ignore_errors=True)
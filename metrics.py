@@ -0,0 +1,206 @@
+'''
+Phase timing and model size instrumentation.
+
+A SolveProfile goes along with every Matcher and records, for each phase of a solve (parsing the
+files, building the model, the solver run, extracting the assignment, writing the results), its
+wall time and how much the resident memory of the process grew over it, read from /proc/self/statm
+before and after. Memory the phase frees again before it ends doesn't show, and CBC runs in its own
+process so the solver phase only counts what the model and the solution take on this side (for the
+peak of a whole run, CBC included, see peakMemory and bench_matcher.py). The growth is None where
+/proc isn't available (macOS, Windows).
+The profile also keeps the size of the model that was solved: variables, constraints and nonzeros.
+
+SolveMetrics collects the profiles of every solve the web app ran into Prometheus histograms, served
+as text on /metrics.
+'''
+
+import os
+import sys
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PHASE_SECONDS_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+MEMORY_BYTES_BUCKETS = [2 ** power for power in range(20, 35, 2)]  # 1MB to 16GB
+MODEL_SIZE_BUCKETS = [10 ** power for power in range(2, 9)]
+
+
+def peakMemory(children=False):
+    # Resident set high-water mark in bytes (ru_maxrss is in kilobytes on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def residentMemory():
+    # Current resident set in bytes, the second field of /proc/self/statm counts pages
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PhaseTiming:
+    def __init__(self, name, seconds, memoryGrowth):
+        self.name = name
+        self.seconds = seconds
+        self.memoryGrowth = memoryGrowth
+
+    def summary(self):
+        if self.memoryGrowth is None:
+            return '%.3f s' % self.seconds
+        return '%.3f s, memory %+.1f MB' % (self.seconds, self.memoryGrowth / 1048576.0)
+
+    def toDict(self):
+        return {"name": self.name, "seconds": self.seconds, "memoryGrowth": self.memoryGrowth}
+
+
+class SolveProfile:
+    """
+    Example Usage:
+        profile = SolveProfile()
+        with profile.phase('parse'):
+            ...
+        profile.setModelSize(variables, constraints, nonzeros)
+        for timing in profile.phases:
+            print(timing.name, timing.summary())
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.variables = None
+        self.constraints = None
+        self.nonzeros = None
+
+    @contextmanager
+    def phase(self, name):
+        # A phase that runs more than once (or is nested in a subclass override) adds up its time and growth
+        start = perf_counter()
+        memoryBefore = residentMemory()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            memoryAfter = residentMemory()
+            memory = None if memoryBefore is None or memoryAfter is None else memoryAfter - memoryBefore
+            for timing in self.phases:
+                if timing.name == name:
+                    timing.seconds += seconds
+                    if timing.memoryGrowth is not None and memory is not None:
+                        timing.memoryGrowth += memory
+                    break
+            else:
+                self.phases.append(PhaseTiming(name, seconds, memory))
+
+    def setModelSize(self, variables, constraints, nonzeros):
+        self.variables = int(variables)
+        self.constraints = int(constraints)
+        self.nonzeros = int(nonzeros)
+
+    def modelSize(self):
+        return {"variables": self.variables, "constraints": self.constraints, "nonzeros": self.nonzeros}
+
+    @property
+    def seconds(self):
+        return sum(timing.seconds for timing in self.phases)
+
+    def toDict(self):
+        return {"phases": [timing.toDict() for timing in self.phases], "model": self.modelSize(),
+                "seconds": self.seconds}
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.label = label
+        # label value -> [bucket counts..., +Inf count], sum
+        self.series = {}
+
+    def observe(self, value, labelValue=None):
+        counts, total = self.series.get(labelValue, ([0] * (len(self.buckets) + 1), 0.0))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-1] += 1
+        self.series[labelValue] = (counts, total + value)
+
+    def lines(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for labelValue in sorted(self.series, key=str):
+            counts, total = self.series[labelValue]
+            labels = '' if self.label is None else '%s="%s",' % (self.label, labelValue)
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                lines.append('%s_bucket{%sle="%s"} %d' % (self.name, labels, bound, count))
+            labels = labels.rstrip(',')
+            labels = '{%s}' % labels if labels else ''
+            lines.append('%s_sum%s %r' % (self.name, labels, total))
+            lines.append('%s_count%s %d' % (self.name, labels, counts[-1]))
+        return lines
+
+
+class SolveMetrics:
+    """
+    Example Usage:
+        metrics = SolveMetrics()
+        metrics.observe(results)  # a MatchResults with its profile
+        metrics.countCacheHit()
+        text = metrics.render()  # Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.phaseSeconds = Histogram('matcher_phase_seconds', 'Wall time of each solve phase.',
+                                      PHASE_SECONDS_BUCKETS, label='phase')
+        self.phaseMemoryGrowth = Histogram('matcher_phase_memory_growth_bytes',
+                                           'Growth of the resident memory of the solve process over each phase.',
+                                           MEMORY_BYTES_BUCKETS, label='phase')
+        self.solveSeconds = Histogram('matcher_solve_seconds', 'Wall time of a whole solve.',
+                                      PHASE_SECONDS_BUCKETS)
+        self.modelSize = Histogram('matcher_model_size', 'Size of the solved model.',
+                                   MODEL_SIZE_BUCKETS, label='dimension')
+        self.solves = {}
+        self.cacheHits = 0
+
+    def observe(self, results):
+        with self.lock:
+            self.solves[results.status] = self.solves.get(results.status, 0) + 1
+            profile = results.profile
+            if profile is None:
+                return
+            for timing in profile.phases:
+                self.phaseSeconds.observe(timing.seconds, timing.name)
+                if timing.memoryGrowth is not None:
+                    # A phase that ended up freeing memory counts as no growth
+                    self.phaseMemoryGrowth.observe(max(timing.memoryGrowth, 0), timing.name)
+            self.solveSeconds.observe(profile.seconds)
+            for dimension, size in profile.modelSize().items():
+                if size is not None:
+                    self.modelSize.observe(size, dimension)
+
+    def countCacheHit(self):
+        with self.lock:
+            self.cacheHits += 1
+
+    def render(self):
+        with self.lock:
+            lines = ['# HELP matcher_solves_total Solves finished, by solution status.',
+                     '# TYPE matcher_solves_total counter']
+            for status in sorted(self.solves):
+                lines.append('matcher_solves_total{status="%s"} %d' % (status, self.solves[status]))
+            lines += ['# HELP matcher_cache_hits_total Uploads answered from the solution cache.',
+                      '# TYPE matcher_cache_hits_total counter',
+                      'matcher_cache_hits_total %d' % self.cacheHits]
+            for histogram in (self.solveSeconds, self.phaseSeconds, self.phaseMemoryGrowth, self.modelSize):
+                lines += histogram.lines()
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,91 @@
+'''
+Solver portfolio for the assignment model.
+
+How long CBC takes on the same model varies a lot with its random seed and with which cuts and
+heuristics happen to work, and a solve only keeps one core busy. AssignmentModel.solvePortfolio (see
+matrixmodel.py) races several CBC configurations on the model at once, one process each:
+    -default: CBC as solveCBC runs it
+    -seed: a different random seed, so the search takes other branches
+    -noCuts: no cut generation, which is often faster to a good incumbent
+    -proximity: proximity search, a local search around the incumbent
+    -threads: CBC's own parallel branch and bound on two threads
+The first to prove optimality wins and the others are killed. If none does before the time limit,
+the best incumbent of the lot is kept. Every racer's new incumbents are printed as they are found.
+'''
+
+import os
+import re
+import subprocess
+from threading import Thread
+from time import perf_counter
+
+# (name, CBC options) in the order they join a race
+PORTFOLIO = (
+    ("default", []),
+    ("seed", ["-randomCbcSeed", "12345", "-randomSeed", "12345"]),
+    ("noCuts", ["-cutsOnOff", "off"]),
+    ("proximity", ["-proximitySearch", "on"]),
+    ("threads", ["-threads", "2"]),
+)
+
+INCUMBENT = re.compile(r"Integer solution of (-?[0-9.e+]+) found")
+
+
+def portfolioConfigurations(count=None):
+    # One configuration per core by default, but always at least two so there is a race
+    count = count or max(2, os.cpu_count() or 1)
+    return PORTFOLIO[:count]
+
+
+class Racer:
+    """
+    One CBC process of a race. A thread reads its log as it is written, prints every new incumbent
+    and puts the racer on the `finished` queue when the process exits.
+    """
+
+    def __init__(self, name, args, solPath, finished):
+        self.name = name
+        self.solPath = solPath
+        self.lines = []
+        self.incumbent = None
+        self.start = perf_counter()
+        # On a pseudo terminal CBC writes its log line by line rather than in blocks, where there is one
+        try:
+            import pty
+            output, terminal = pty.openpty()
+        except (ImportError, OSError):
+            output, terminal = None, None
+        self.process = subprocess.Popen(args, stdout=terminal or subprocess.PIPE)
+        if terminal is not None:
+            os.close(terminal)
+            stream = os.fdopen(output, 'rb')
+        else:
+            stream = self.process.stdout
+        Thread(target=self.readLog, args=(stream, finished), daemon=True).start()
+
+    def readLog(self, stream, finished):
+        try:
+            for line in stream:
+                line = line.decode('utf-8', 'replace').replace('\r', '')
+                self.lines.append(line)
+                match = INCUMBENT.search(line)
+                if match:
+                    # CBC minimizes the negated objective
+                    self.incumbent = abs(float(match.group(1)))
+                    print("Portfolio: %s found %g after %.1fs" % (self.name, self.incumbent,
+                                                                  perf_counter() - self.start))
+        except OSError:
+            # Linux reports the end of a pseudo terminal's output as an error
+            pass
+        finally:
+            stream.close()
+        self.process.wait()
+        finished.put(self)
+
+    @property
+    def log(self):
+        return "".join(self.lines)
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
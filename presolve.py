@@ -0,0 +1,94 @@
+'''
+Safe fixings on the preference edges before the model is built.
+
+Presolve shrinks the hard constraint model without changing its optimal objective:
+    -a course fewer students listed than its minimum (or with a maximum of 0, or below its minimum)
+     can never run, so it is closed and every edge to it is dropped
+    -a student is fixed to their best remaining course c when:
+        -everyone who listed c fits under its maximum, so c never has to turn anyone away
+        -enough students can be fixed to c to reach its minimum, so c always runs with them
+        -every other course the student listed has a minimum of at most 1, so no course can fall
+         below its minimum when the student leaves it
+     Taking any optimal assignment and moving all such students to their course keeps every course
+     feasible and never lowers a student's weight, so some optimal assignment has them all fixed.
+The fixed students and the closed courses' edges are left out of the model. The courses the fixed
+students fill keep only the room they have left, and need no more students to run.
+
+Fixings holds that reduced instance for any set of fixed students, so other ways of fixing students
+(see stability.py) build their models the same way.
+'''
+
+import numpy as np
+
+
+class Fixings:
+    """
+    Students fixed to a course (fixed, -1 for not fixed), the edges the model keeps (keptEdges) and
+    courses that can't run (closedCourses), with the course sizes the kept edges are left with. Every
+    course with fixed students must reach its minimum with them.
+    """
+
+    def __init__(self, students, courses, weights, S, courseMins, courseMaxs, fixed, keptEdges, closedCourses):
+        courseMins = np.asarray(courseMins, dtype=np.int64)
+        courseMaxs = np.asarray(courseMaxs, dtype=np.int64)
+        self.S = S
+        self.C = len(courseMaxs)
+        self.E = len(students)
+        self.fixed = fixed
+        self.keptEdges = keptEdges
+        self.closedCourses = closedCourses
+
+        fixedCounts = np.bincount(fixed[fixed >= 0], minlength=self.C)
+        self.courseMins = np.where(closedCourses, 0, np.maximum(courseMins - fixedCounts, 0))
+        self.courseMaxs = np.where(closedCourses, 0, courseMaxs - fixedCounts)
+        self.fixedWeight = int(np.asarray(weights)[courses == fixed[students]].sum())
+
+    def fixedPairs(self):
+        # (students, courses) of the fixed assignments
+        fixedStudents = np.flatnonzero(self.fixed >= 0)
+        return fixedStudents, self.fixed[fixedStudents]
+
+    def summary(self):
+        return "%d of %d students fixed, %d of %d courses closed, %d of %d edges left" % (
+            np.count_nonzero(self.fixed >= 0), self.S, np.count_nonzero(self.closedCourses), self.C,
+            np.count_nonzero(self.keptEdges), self.E)
+
+
+class Presolve(Fixings):
+    """
+    Example Usage:
+        presolved = Presolve(students, courses, weights, ranks, S, courseMins, courseMaxs)
+        presolved.keptEdges     # edges the model still needs
+        presolved.courseMins    # minimums and maximums for those edges
+        presolved.fixed         # course index per student, -1 if not fixed
+    """
+
+    def __init__(self, students, courses, weights, ranks, S, courseMins, courseMaxs):
+        courseMins = np.asarray(courseMins, dtype=np.int64)
+        courseMaxs = np.asarray(courseMaxs, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.int64)
+        C = len(courseMaxs)
+
+        # Students listed each course at most once, so the edges to a course count its demand
+        demand = np.bincount(courses, minlength=C)
+        closedCourses = (demand < courseMins) | (courseMaxs < np.maximum(courseMins, 1))
+        usable = ~closedCourses[courses]
+
+        # Each student's best usable course, the earliest ranked one on a tie
+        best = np.zeros(S, dtype=np.int64)
+        np.maximum.at(best, students[usable], weights[usable])
+        topEdges = np.flatnonzero(usable & (weights == best[students]))
+        topEdges = topEdges[np.lexsort((ranks[topEdges], students[topEdges]))]
+        topStudents, firstTop = np.unique(students[topEdges], return_index=True)
+        candidates = np.full(S, -1, dtype=np.int64)
+        candidates[topStudents] = courses[topEdges[firstTop]]
+
+        # Students who would leave a course that needs more than one student can't be fixed
+        blocking = usable & (courseMins[courses] > 1) & (courses != candidates[students])
+        candidates[students[blocking]] = -1
+
+        fixable = np.bincount(candidates[candidates >= 0], minlength=C)
+        safeCourses = ~closedCourses & (demand <= courseMaxs) & (fixable >= courseMins) & (fixable > 0)
+        fixed = np.where((candidates >= 0) & safeCourses[np.maximum(candidates, 0)], candidates, -1)
+        super(Presolve, self).__init__(students, courses, weights, S, courseMins, courseMaxs, fixed,
+                                       usable & (fixed[students] < 0), closedCourses)
@@ -0,0 +1,140 @@
+'''
+Structured results of a solve, as built by Matcher.outputResults.
+
+The web app renders these directly instead of writing the Output_* CSV files and reading them back.
+Tables are column oriented (one list per column) and every stat keeps its count and total as numbers.
+'''
+
+# Bump when the shape of MatchResults changes, so old cached results aren't reused
+RESULTS_FORMAT = 5
+
+STUDENT_COLUMNS = ['Student ID', 'First Name', 'Last Name', 'First choice', 'Second choice', 'Third choice']
+ASSIGNED_STUDENT_COLUMNS = STUDENT_COLUMNS + ['Course Assignment']
+COURSE_COLUMNS = ['Course number', 'Course name', 'Total Choices', 'Total First choices',
+                  'Total Second choices', 'Total Third choices', 'Weight', 'Minimum class size',
+                  'Maximum class size', 'Students assigned', 'Assigned First choices',
+                  'Assigned Second choices', 'Assigned Third choices', 'Assigned Weight']
+BOTTLENECK_COLUMNS = ['Course number', 'Course name', 'Minimum class size', 'Maximum class size',
+                      'Total First choices', 'Total Choices', 'Bottleneck']
+SCENARIO_COLUMNS = ['Scenario', 'First choice value', 'Second choice value', 'Third choice value',
+                    'Course size changes', 'Solution Status', 'Objective Value', 'Objective Bound',
+                    'Optimality Gap', 'First Choice Assignments', 'Second Choice Assignments',
+                    'Third Choice Assignments', 'No Assignments', 'Courses running',
+                    'Students moved from first scenario', 'Warm start from', 'Seconds']
+
+
+class ResultTable:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.data = {column: [] for column in self.columns}
+
+    @classmethod
+    def fromColumns(cls, columns, values):
+        table = cls(columns)
+        for column, columnValues in zip(table.columns, values):
+            table.data[column] = list(columnValues)
+        return table
+
+    def __len__(self):
+        return len(self.data[self.columns[0]]) if self.columns else 0
+
+    def addRow(self, row):
+        for column, value in zip(self.columns, row):
+            self.data[column].append(value)
+
+    def rows(self):
+        return zip(*[self.data[column] for column in self.columns])
+
+    def toDict(self):
+        return {"columns": self.columns, "data": self.data}
+
+
+class Stat:
+    def __init__(self, name, count, total):
+        self.name = name
+        self.count = count
+        self.total = total
+
+    @property
+    def ratio(self):
+        return float(self.count) / self.total if self.total else 0.0
+
+    def summary(self):
+        return '%.5f (%d/%d)' % (self.ratio, self.count, self.total)
+
+    def __str__(self):
+        return '%s: %s' % (self.name, self.summary())
+
+    def toDict(self):
+        return {"name": self.name, "count": self.count, "total": self.total, "ratio": self.ratio}
+
+
+class MatchResults:
+    def __init__(self, status):
+        self.status = status
+        self.stats = []
+        self.courses = ResultTable(COURSE_COLUMNS)
+        self.assignedStudents = ResultTable(ASSIGNED_STUDENT_COLUMNS)
+        self.unassignedStudents = ResultTable(STUDENT_COLUMNS)
+        self.bulletVotingStudents = ResultTable(ASSIGNED_STUDENT_COLUMNS)
+        # Courses that hold the solution back, and how many students can be placed at all (see analysis.py)
+        self.bottlenecks = ResultTable(BOTTLENECK_COLUMNS)
+        self.placeable = None
+        # Output_* file name -> bytes, filled in by Matcher.outputResults
+        self.files = {}
+        # Phase timings and model size of the solve (metrics.SolveProfile)
+        self.profile = None
+        # Objective of the assignment and the best upper bound known for it
+        self.objective = None
+        self.bound = None
+
+    @property
+    def gap(self):
+        # Relative optimality gap, 0 when the assignment is proven optimal
+        if self.objective is None or self.bound is None:
+            return None
+        return float(self.bound - self.objective) / self.bound if self.bound else 0.0
+
+    def boundLines(self):
+        if self.gap is None:
+            return []
+        return ['Objective Value: %d' % self.objective, 'Objective Bound: %d' % self.bound,
+                'Optimality Gap: %.5f' % self.gap]
+
+    def addStat(self, name, count, total):
+        self.stats.append(Stat(name, count, total))
+
+    def statLines(self):
+        # The rows of Output_Stats.csv
+        return ['Solution Status: %s' % self.status] + [str(stat) for stat in self.stats] + self.boundLines()
+
+    def toDict(self):
+        return {
+            "status": self.status,
+            "objective": self.objective,
+            "bound": self.bound,
+            "gap": self.gap,
+            "stats": [stat.toDict() for stat in self.stats],
+            "courses": self.courses.toDict(),
+            "assignedStudents": self.assignedStudents.toDict(),
+            "unassignedStudents": self.unassignedStudents.toDict(),
+            "bulletVotingStudents": self.bulletVotingStudents.toDict(),
+            "bottlenecks": self.bottlenecks.toDict(),
+            "placeable": self.placeable,
+            "profile": self.profile.toDict() if self.profile is not None else None,
+        }
+
+
+class ScenarioResults:
+    """
+    The scenarios of a batch side by side (see scenarios.py): one row of SCENARIO_COLUMNS per
+    scenario, in the order they were given.
+    """
+
+    def __init__(self):
+        self.scenarios = ResultTable(SCENARIO_COLUMNS)
+        # Output_Scenarios.csv -> bytes, filled in by scenarios.solveScenarios
+        self.files = {}
+
+    def toDict(self):
+        return {"scenarios": self.scenarios.toDict()}
@@ -0,0 +1,200 @@
+'''
+What-if solves: one roster under several objective values and course sizes.
+
+A scenario is given as a dict such as
+    {"name": "Bigger art room", "p1_ObjectiveValue": 6, "courseMins": {"4": 8}, "courseMaxs": {"4": 30}}
+with the objective values of first, second and third choices (the defaults when left out) and new
+minimums or maximums for some courses, keyed by course number as in the students file.
+
+solveScenarios solves a batch of them side by side:
+    -the files are parsed once; the Roster goes to each pool process once, when the process starts,
+     and every scenario builds its model from it with its own values and sizes
+    -up to `workers` scenarios solve at once, each in its own process
+    -a scenario that starts after others have finished starts from the assignment of the nearest one
+     (see scenarioDistance), repaired to fit its course sizes (see Matcher.solve's startAssignment);
+     the first ones start from the greedy assignment as usual
+    -the result (results.ScenarioResults) has one row per scenario: its status, objective, how many
+     students got which choice, and how many it moved from the first scenario's assignment
+'''
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from csv import writer, QUOTE_MINIMAL
+from io import StringIO
+from time import perf_counter
+
+import numpy as np
+
+from matcher import AggregatedHardConstraintMatcher
+from results import ScenarioResults
+
+# The roster of the batch, set once in each pool process by initWorker
+workerRoster = None
+
+
+class Scenario:
+    """
+    Example Usage:
+        scenario = Scenario.fromDict({"name": "Small classes", "courseMaxs": {"2": 20}}, (5, 3, 1), C)
+        scenario.values      # (p1, p2, p3) objective values
+        scenario.courseMaxs  # {course index: new maximum}
+    """
+
+    def __init__(self, name, values, courseMins=None, courseMaxs=None):
+        self.name = name
+        self.values = tuple(values)
+        self.courseMins = dict(courseMins or {})
+        self.courseMaxs = dict(courseMaxs or {})
+
+    @classmethod
+    def fromDict(cls, scenario, defaultValues, C):
+        # Checks everything a scenario from the web form sets, raising ValueError with what to fix
+        name = str(scenario.get("name", ""))
+        values = []
+        for key, default in zip(("p1_ObjectiveValue", "p2_ObjectiveValue", "p3_ObjectiveValue"), defaultValues):
+            value = wholeNumber(scenario.get(key, default))
+            if value is None or value < 1:
+                raise ValueError("Scenario '%s': %s must be a whole number of 1 or more" % (name, key))
+            values.append(value)
+
+        sizes = []
+        for key in ("courseMins", "courseMaxs"):
+            changes = scenario.get(key, {})
+            if not isinstance(changes, dict):
+                raise ValueError("Scenario '%s': %s must map course numbers to sizes" % (name, key))
+            courseSizes = {}
+            for courseId, size in changes.items():
+                c = wholeNumber(courseId)
+                size = wholeNumber(size)
+                if c is None or c - 1 not in range(C) or size is None or size < 0:
+                    raise ValueError("Scenario '%s': %s needs course numbers from 1 to %d and whole sizes of 0 "
+                                     "or more" % (name, key, C))
+                courseSizes[c - 1] = size
+            sizes.append(courseSizes)
+        return cls(name, values, *sizes)
+
+    def apply(self, matcher):
+        # The matcher's course sizes with this scenario's changes; the roster's arrays are left alone
+        matcher.courseMins = matcher.courseMins.copy()
+        matcher.courseMaxs = matcher.courseMaxs.copy()
+        for c, size in self.courseMins.items():
+            matcher.courseMins[c] = size
+        for c, size in self.courseMaxs.items():
+            matcher.courseMaxs[c] = size
+
+    def describeChanges(self):
+        changes = ["Course %d min %d" % (c + 1, size) for c, size in sorted(self.courseMins.items())]
+        changes += ["Course %d max %d" % (c + 1, size) for c, size in sorted(self.courseMaxs.items())]
+        return ", ".join(changes)
+
+
+def wholeNumber(value):
+    # An int from a JSON number or numeric string, None for anything else (2.5, "six", true, ...)
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else None
+
+
+def scenarioDistance(a, b):
+    # Objective values compared relative to the first choice's, plus one for every course size that differs
+    valuesA = np.array(a.values, dtype=float) / max(a.values[0], 1)
+    valuesB = np.array(b.values, dtype=float) / max(b.values[0], 1)
+    sizeChanges = sum(sizesA.get(c) != sizesB.get(c) for sizesA, sizesB in
+                      ((a.courseMins, b.courseMins), (a.courseMaxs, b.courseMaxs)) for c in set(sizesA) | set(sizesB))
+    return float(np.abs(valuesA - valuesB).sum()) + sizeChanges
+
+
+def initWorker(roster):
+    global workerRoster
+    workerRoster = roster
+
+
+def solveScenario(scenario, matcherClass, solveOptions, startAssignment):
+    # Runs in a pool process, on the roster initWorker left there
+    start = perf_counter()
+    c1Value, c2Value, c3Value = scenario.values
+    matcher = matcherClass(p1_ObjectiveValue=c1Value, p2_ObjectiveValue=c2Value, p3_ObjectiveValue=c3Value,
+                           roster=workerRoster)
+    scenario.apply(matcher)
+    matcher.solve(startAssignment=startAssignment, **solveOptions)
+    matcher.outputResults(directory=None)
+    assigned = matcher.assignment >= 0
+    return {
+        "status": matcher.results.status,
+        "objective": matcher.results.objective,
+        "bound": matcher.results.bound,
+        "gap": matcher.results.gap,
+        "stats": {stat.name: stat.count for stat in matcher.results.stats},
+        "coursesRunning": int(np.count_nonzero(np.bincount(matcher.assignment[assigned], minlength=matcher.C))),
+        "assignment": matcher.assignment if matcher.hasSolution() else None,
+        "seconds": perf_counter() - start,
+    }
+
+
+def solveScenarios(roster, scenarios, solveOptions=None, matcherClass=AggregatedHardConstraintMatcher, workers=None):
+    """
+    Solves every Scenario on the roster with matcherClass, up to `workers` at a time, passing the
+    solveOptions dict on to Matcher.solve. Returns a ScenarioResults with the scenarios in the given order.
+    """
+    if not scenarios:
+        raise ValueError("A scenario batch needs at least one scenario")
+    solveOptions = dict(solveOptions or {})
+    workers = min(workers or os.cpu_count() or 1, len(scenarios))
+    solutions = [None] * len(scenarios)
+    startedFrom = [None] * len(scenarios)
+    pending = list(range(len(scenarios)))
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(roster,)) as pool:
+        while pending or running:
+            while pending and len(running) < workers:
+                i = pending.pop(0)
+                finished = [j for j, solution in enumerate(solutions)
+                            if solution is not None and solution["assignment"] is not None]
+                startAssignment = None
+                if finished:
+                    startedFrom[i] = min(finished, key=lambda j: scenarioDistance(scenarios[i], scenarios[j]))
+                    startAssignment = solutions[startedFrom[i]]["assignment"]
+                running[pool.submit(solveScenario, scenarios[i], matcherClass, solveOptions, startAssignment)] = i
+            done, notDone = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                solutions[running.pop(future)] = future.result()
+    return compareScenarios(scenarios, solutions, startedFrom)
+
+
+def compareScenarios(scenarios, solutions, startedFrom):
+    results = ScenarioResults()
+    baseline = solutions[0]["assignment"]
+    for scenario, solution, origin in zip(scenarios, solutions, startedFrom):
+        moved = None
+        if baseline is not None and solution["assignment"] is not None:
+            moved = int(np.count_nonzero(solution["assignment"] != baseline))
+        results.scenarios.addRow([
+            scenario.name,
+            scenario.values[0],
+            scenario.values[1],
+            scenario.values[2],
+            scenario.describeChanges(),
+            solution["status"],
+            solution["objective"],
+            solution["bound"],
+            solution["gap"],
+            solution["stats"]['First Choice Assignments'],
+            solution["stats"]['Second Choice Assignments'],
+            solution["stats"]['Third Choice Assignments'],
+            solution["stats"]['No Assignments'],
+            solution["coursesRunning"],
+            moved,
+            "" if origin is None else scenarios[origin].name,
+            round(solution["seconds"], 2),
+        ])
+
+    with StringIO() as table_file:
+        table_writer = writer(table_file, delimiter=',', quotechar='"', quoting=QUOTE_MINIMAL, lineterminator='\n')
+        table_writer.writerow(results.scenarios.columns)
+        table_writer.writerows(results.scenarios.rows())
+        results.files['Output_Scenarios.csv'] = table_file.getvalue().encode('utf-8')
+    return results
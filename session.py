@@ -0,0 +1,194 @@
+'''
+Incremental re-solves of a PuLP matcher after small roster edits.
+
+A SolveSession keeps the HardConstraintMatcher (or SparseHardConstraintMatcher) model of a finished
+solve and patches it for each edit instead of building it again:
+    -a new student gets variables for the courses they listed, an objective term for each, their own
+     "at most one course" row, and a term in the minimum and maximum rows of each of those courses
+    -a removed student's variables are fixed to 0, which CBC's presolve drops; they stay in the model
+     but are no longer in the matcher's lists, so every later student moves down an index
+    -changing a student's choices retires their variables the same way and gives them new ones
+    -a course's minimum or maximum is one coefficient of classWillRun in its minimum or maximum row
+    -a closed course has classWillRun fixed to 0, reopening it frees it again
+
+solve() re-solves from the previous assignment, repaired to fit the edits: students are dropped from
+courses they no longer listed, courses over their new maximum give up their lowest weight students,
+courses under their new minimum are emptied, and local search (see localsearch.py) places the new and
+dropped students where it can. CBC starts from that instead of from nothing.
+
+Retired variables pile up over many edits, so a long session is worth a fresh solve now and then.
+'''
+
+import numpy as np
+from pulp import LpAffineExpression, LpProblem, LpVariable, LpInteger
+
+from ingest import MISSING
+from localsearch import LocalSearch
+from matcher import CBC, SparseHardConstraintMatcher
+
+
+class SolveSession:
+    """
+    Example Usage:
+        matcher = HardConstraintMatcher(...)
+        matcher.solve()
+        session = SolveSession(matcher)
+        session.addStudent("Ada", "Lovelace", [3, 5, 1])  # course numbers, as in the students file
+        session.setCourseSize(4, courseMax=30)          # course index
+        session.solve(timeLimit=15)
+        matcher.outputResults()
+
+    Students and courses are 0-based indexes, as in matcher.assignment; choices are course numbers
+    with None for a blank choice.
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        if not isinstance(getattr(matcher, 'model', None), LpProblem):
+            # Solved without the PuLP model (as a flow, greedily or with HiGHS), so it is built once here
+            if not hasattr(matcher, 'linkingCuts'):
+                matcher.linkingCuts = False
+            matcher.initProblem()
+        if getattr(matcher, 'presolved', None) is not None:
+            # Presolve's (or a stable re-solve's) fixings only hold for the roster they were found on
+            students, courses, weights, ranks = matcher.preferenceEdges()
+            for s, c in zip(students.tolist(), courses.tolist()):
+                matcher.studentAssignments[s][c].lowBound = 0
+                matcher.studentAssignments[s][c].upBound = 1
+            for c in np.flatnonzero(matcher.presolved.closedCourses):
+                matcher.classWillRun[c].upBound = 1
+            matcher.presolved = None
+
+        self.sparse = isinstance(matcher, SparseHardConstraintMatcher)
+        self.closedCourses = np.zeros(matcher.C, dtype=bool)
+        self.assignment = np.array(getattr(matcher, 'assignment', np.full(matcher.S, -1)), dtype=np.int64)
+        # Variable names of new students continue after the ones initVariables gave out
+        self.nextName = matcher.S
+
+    def addStudent(self, firstName, lastName, choices):
+        # Returns the new student's index
+        s = self.matcher.S
+        self.matcher.studentFirstName.append(firstName)
+        self.matcher.studentLastName.append(lastName)
+        self.matcher.choices = np.vstack([self.matcher.choices, self.choiceRow(choices)])
+        self.matcher.choiceMissing = np.vstack([self.matcher.choiceMissing, self.choiceRow(choices) == MISSING])
+        self.matcher.S += 1
+        self.matcher.studentAssignments.append(None)
+        self.matcher.studentPreferences.append(None)
+        self.assignment = np.append(self.assignment, -1)
+        self.addStudentVariables(s)
+        self.refreshChoiceLists()
+        return s
+
+    def removeStudent(self, s):
+        self.retireStudentVariables(s)
+        for values in (self.matcher.studentFirstName, self.matcher.studentLastName,
+                       self.matcher.studentAssignments, self.matcher.studentPreferences):
+            del values[s]
+        self.matcher.choices = np.delete(self.matcher.choices, s, axis=0)
+        self.matcher.choiceMissing = np.delete(self.matcher.choiceMissing, s, axis=0)
+        self.matcher.S -= 1
+        self.assignment = np.delete(self.assignment, s)
+        self.refreshChoiceLists()
+
+    def setChoices(self, s, choices):
+        self.retireStudentVariables(s)
+        self.matcher.choices[s] = self.choiceRow(choices)
+        self.matcher.choiceMissing[s] = self.matcher.choices[s] == MISSING
+        self.addStudentVariables(s)
+        self.refreshChoiceLists()
+
+    def setCourseSize(self, c, courseMin=None, courseMax=None):
+        # classWillRun's coefficient is -min in the minimum row and -max in the maximum row
+        for row, sizes, size in ((0, self.matcher.courseMins, courseMin), (1, self.matcher.courseMaxs, courseMax)):
+            if size is None:
+                continue
+            self.matcher.classConstraints[row][c].addInPlace((int(sizes[c]) - size) * self.matcher.classWillRun[c])
+            sizes[c] = size
+
+    def closeCourse(self, c):
+        self.closedCourses[c] = True
+        self.matcher.classWillRun[c].upBound = 0
+
+    def openCourse(self, c):
+        self.closedCourses[c] = False
+        self.matcher.classWillRun[c].upBound = 1
+
+    def choiceRow(self, choices):
+        # Choice array row: course numbers, MISSING for a blank
+        row = [MISSING if choice is None else int(choice) for choice in list(choices)[:3]]
+        row += [MISSING] * (3 - len(row))
+        if any(choice != MISSING and not 1 <= choice <= self.matcher.C for choice in row):
+            raise ValueError("Choices must be course numbers from 1 to %d" % self.matcher.C)
+        return np.array(row, dtype=self.matcher.choices.dtype)
+
+    def refreshChoiceLists(self):
+        self.matcher.studentFirstChoices, self.matcher.studentSecondChoices, self.matcher.studentThirdChoices = [
+            [choice if choice != MISSING else None for choice in self.matcher.choices[:, rank].tolist()]
+            for rank in range(3)]
+
+    def studentVariables(self, s):
+        # The student's variables, for both the list (dense) and dict (sparse) layouts
+        assignments = self.matcher.studentAssignments[s]
+        return list(assignments.values()) if self.sparse else assignments
+
+    def retireStudentVariables(self, s):
+        for variable in self.studentVariables(s):
+            variable.upBound = 0
+
+    def addStudentVariables(self, s):
+        # Variables for the courses the student listed, with the weights of Matcher.makeObjective
+        c1, c2, c3 = [choice if choice != MISSING else None for choice in self.matcher.choices[s].tolist()]
+        uniqueChoices = 0 if self.matcher.notUniqueChoices(c1, c2, c3) else 1
+        preferences = {}
+        for choice, choiceValue in ((c1, self.matcher.c1Value), (c2, self.matcher.c2Value), (c3, self.matcher.c3Value)):
+            if choice is not None and (choice - 1) not in preferences:
+                preferences[choice - 1] = (choiceValue - 1) * uniqueChoices + 1
+
+        name = self.nextName
+        self.nextName += 1
+        assignments = {c: LpVariable("S%dC%d" % (name, c), 0, 1, LpInteger) for c in preferences}
+        sumOfAssignments = LpAffineExpression()
+        for c, assignment in assignments.items():
+            self.matcher.model.objective.addInPlace(preferences[c] * assignment)
+            for row in range(2):
+                self.matcher.classConstraints[row][c].addInPlace(assignment)
+            sumOfAssignments += assignment
+        if assignments:
+            self.matcher.model += sumOfAssignments <= 1
+
+        if self.sparse:
+            self.matcher.studentAssignments[s] = assignments
+            self.matcher.studentPreferences[s] = preferences
+        else:
+            # The dense layout needs a variable for every course; the unlisted ones are fixed to 0
+            self.matcher.studentAssignments[s] = [
+                assignments[c] if c in assignments else LpVariable("S%dC%d" % (name, c), 0, 0, LpInteger)
+                for c in range(self.matcher.C)]
+            self.matcher.studentPreferences[s] = [preferences.get(c, 0) for c in range(self.matcher.C)]
+
+    def startAssignment(self, localSearchTime=None):
+        # The previous assignment, made feasible for the edited roster and improved by local search
+        students, courses, weights, ranks = self.matcher.preferenceEdges()
+        courseMaxs = np.where(self.closedCourses, 0, self.matcher.courseMaxs)
+        search = LocalSearch(students, courses, weights, self.matcher.S, self.matcher.courseMins, courseMaxs)
+        return search.improve(search.repair(self.assignment), timeLimit=localSearchTime)
+
+    def solve(self, solver=CBC, timeLimit=15, gapTarget=None, localSearchTime=None):
+        """
+        Re-solves the patched model from the repaired previous assignment. Takes the same solver,
+        timeLimit and gapTarget as Matcher.solve; localSearchTime limits the repair's local search.
+        """
+        matcher = self.matcher
+        matcher.bound = None
+        matcher.nodes = None
+        matcher.solver = solver
+        matcher.gapTarget = gapTarget
+        matcher.analyze()
+        with matcher.profile.phase('repairStart'):
+            start = self.startAssignment(localSearchTime)
+        for variable in matcher.model.variables():
+            variable.varValue = None
+        matcher.setStart(start)
+        matcher.solveProblem(solver, timeLimit, gapTarget)
+        self.assignment = matcher.assignment.copy()
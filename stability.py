@@ -0,0 +1,80 @@
+'''
+Re-solves that keep a published assignment wherever a roster change didn't touch it.
+
+Given the previous assignment of the current students (see matchPreviousAssignment),
+StableNeighborhood fixes every student whose assignment still stands and frees the rest:
+    -students without a previous course: new students and the ones left unassigned before
+    -students whose course is no longer one of their choices
+    -every student of a course that no longer fits its limits, because it lost students below its
+     minimum or holds more than its new maximum
+Only the free students' edges go into the model, with the room the fixed students leave in each
+course (see presolve.Fixings), so the model shrinks to the neighborhood of the change. A course with
+fixed students still holds all of its kept students, so it stays within its limits.
+
+Matcher.solve(previousAssignment=...) solves the neighborhood and, if that finds no assignment,
+widens it by a ring at a time: every student kept in a course that a free student listed is freed
+too, until the solve succeeds, everyone is free or the time limit is reached. When a ring frees
+nobody new, the rest of the roster isn't connected to the change and the whole instance is solved
+once instead.
+'''
+
+import numpy as np
+
+from presolve import Fixings
+
+
+def matchPreviousAssignment(previousData, studentFirstName, studentLastName, C):
+    """
+    Course index per current student from a previous Output_Assigned_Students table (a DataFrame),
+    -1 for students it doesn't list. Students are matched by first and last name, in file order when
+    a name repeats, since student IDs shift when students are added or removed.
+    """
+    previous = {}
+    for firstName, lastName, courseId in zip(previousData['First Name'], previousData['Last Name'],
+                                             previousData['Course Assignment']):
+        courseId = int(courseId)
+        previous.setdefault((str(firstName), str(lastName)), []).append(courseId - 1 if 1 <= courseId <= C else -1)
+
+    assignment = np.full(len(studentFirstName), -1, dtype=np.int64)
+    for s, name in enumerate(zip(studentFirstName, studentLastName)):
+        courses = previous.get((str(name[0]), str(name[1])))
+        if courses:
+            assignment[s] = courses.pop(0)
+    return assignment
+
+
+class StableNeighborhood(Fixings):
+    """
+    Example Usage:
+        neighborhood = StableNeighborhood(students, courses, weights, S, courseMins, courseMaxs, previous)
+        neighborhood.keptEdges  # the free students' edges
+        neighborhood.fixed      # the previous course of every fixed student, -1 for the free ones
+    """
+
+    def __init__(self, students, courses, weights, S, courseMins, courseMaxs, previous, rings=0):
+        C = len(courseMaxs)
+        courseMins = np.asarray(courseMins, dtype=np.int64)
+        courseMaxs = np.asarray(courseMaxs, dtype=np.int64)
+
+        # Previous assignments the students' current choices still allow
+        kept = np.array(previous, dtype=np.int64)
+        assigned = np.flatnonzero(kept >= 0)
+        kept[assigned[~np.isin(assigned * C + kept[assigned], students * C + courses)]] = -1
+        sizes = np.bincount(kept[kept >= 0], minlength=C)
+        brokenCourses = (sizes > courseMaxs) | ((sizes > 0) & (sizes < courseMins))
+        free = (kept < 0) | brokenCourses[np.maximum(kept, 0)]
+
+        for ring in range(rings):
+            listedCourses = np.zeros(C, dtype=bool)
+            listedCourses[courses[free[students]]] = True
+            free |= listedCourses[np.maximum(kept, 0)]
+
+        self.rings = rings
+        super(StableNeighborhood, self).__init__(students, courses, weights, S, courseMins, courseMaxs,
+                                                 np.where(free, -1, kept), free[students], np.zeros(C, dtype=bool))
+
+    def freesEveryone(self):
+        return not (self.fixed >= 0).any()
+
+    def summary(self):
+        return "%d rings: %s" % (self.rings, super(StableNeighborhood, self).summary())
@@ -0,0 +1,99 @@
+'''
+Synthetic student and course instances for benchmarks.
+
+makeInstance builds a students sheet and a courses sheet with the columns from config.json, shaped
+like real sign-ups:
+    -course popularity follows a Zipf-like law (skew 0 is uniform, larger is more lopsided)
+    -every student picks three different courses, more popular courses more often
+    -a bulletRate share of students repeat a course or leave a choice blank
+    -course maximums spread around capacitySlack * S / C and minimums are about minFraction of the
+     maximum (minFraction=0 gives no minimums, which the matcher solves as a flow)
+    -with clusters > 1, students and courses are split into that many blocks (like grade bands) and
+     students only pick courses of their own block, so the preference graph falls apart
+
+Usage:
+    python synthetic.py S C [prefix]
+
+writes prefix_Students.csv and prefix_Courses.csv (default prefix: Synthetic_S_C).
+'''
+
+import sys
+from json import load
+
+import numpy as np
+from pandas import DataFrame, array
+
+# Students are drawn in blocks so the S x C key matrix stays small
+BLOCK_SIZE = 4096
+
+
+def coursePopularity(C, skew, random):
+    # Zipf weights over a random order of the courses, summing to 1
+    popularity = 1.0 / np.arange(1, C + 1) ** skew
+    return random.permutation(popularity / popularity.sum())
+
+
+def drawChoices(S, popularity, random):
+    # Three different courses per student, weighted by popularity (Gumbel top-k sampling, so the
+    # weights don't need to sum to 1)
+    logPopularity = np.log(popularity)
+    choices = np.empty((S, 3), dtype=np.int64)
+    for start in range(0, S, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, S)
+        keys = logPopularity + random.gumbel(size=(stop - start, len(popularity)))
+        top = np.argpartition(-keys, 2, axis=1)[:, :3]
+        order = np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1)
+        choices[start:stop] = np.take_along_axis(top, order, axis=1) + 1
+    return choices
+
+
+def makeInstance(S, C, students_Columns, courses_Columns, skew=1.0, capacitySlack=1.2, maxSpread=0.5,
+                 minFraction=0.5, bulletRate=0.05, clusters=1, seed=0):
+    """
+    Returns (studentsData, coursesData) DataFrames. Blank choices are pandas NA values. Raises
+    ValueError when a block would have fewer than three courses to choose from.
+    """
+    if clusters < 1 or C // clusters < 3:
+        raise ValueError("%d courses can't be split into %d clusters of at least 3 courses" % (C, clusters))
+    random = np.random.default_rng(seed)
+    popularity = coursePopularity(C, skew, random)
+    choices = np.empty((S, 3), dtype=np.int64)
+    for students, courses in zip(np.array_split(np.arange(S), clusters), np.array_split(np.arange(C), clusters)):
+        choices[students] = courses[drawChoices(len(students), popularity[courses], random) - 1] + 1
+
+    # Bullet voters repeat their first choice or leave later choices blank
+    bulletVoters = np.flatnonzero(random.random(S) < bulletRate)
+    repeat = random.random(len(bulletVoters)) < 0.5
+    choices[bulletVoters[repeat], 1:] = choices[bulletVoters[repeat], :1]
+    blank = np.zeros((S, 3), dtype=bool)
+    blank[bulletVoters[~repeat], 1 + random.integers(0, 2, np.count_nonzero(~repeat))] = True
+
+    studentsData = DataFrame({
+        students_Columns["First_Name"]: ['First%d' % s for s in range(S)],
+        students_Columns["Last_Name"]: ['Last%d' % s for s in range(S)],
+    })
+    for rank, key in enumerate(("P1", "P2", "P3")):
+        studentsData[students_Columns[key]] = array(
+            [None if missing else choice for choice, missing in zip(choices[:, rank].tolist(), blank[:, rank])],
+            dtype="Int64")
+
+    averageMax = capacitySlack * S / C
+    courseMaxs = np.maximum(1, np.rint(averageMax * random.uniform(1 - maxSpread, 1 + maxSpread, C)))
+    courseMins = np.rint(courseMaxs * minFraction * random.uniform(0.5, 1.5, C))
+    courseMins = np.minimum(courseMins, courseMaxs).astype(int)
+    coursesData = DataFrame({
+        courses_Columns["Name"]: ['Course %d' % (c + 1) for c in range(C)],
+        courses_Columns["Min"]: courseMins,
+        courses_Columns["Max"]: courseMaxs.astype(int),
+    })
+    return studentsData, coursesData
+
+
+if __name__ == '__main__':
+    with open('config.json') as config_file:
+        config = load(config_file)
+    S, C = int(sys.argv[1]), int(sys.argv[2])
+    prefix = sys.argv[3] if len(sys.argv) > 3 else 'Synthetic_%d_%d' % (S, C)
+    studentsData, coursesData = makeInstance(S, C, config["students_Columns"], config["courses_Columns"])
+    studentsData.to_csv(prefix + '_Students.csv', index=False)
+    coursesData.to_csv(prefix + '_Courses.csv', index=False)